@@ -0,0 +1,140 @@
+import argparse
+import time
+import typing as T
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+from ms2mol_evaluation.candidates import neutral_masses
+from ms2mol_evaluation.lotus_expanded import TABLE_NAME
+from ms2mol_evaluation.massspecgym import load_massspecgym
+from ms2mol_evaluation.postgres import connect
+
+load_dotenv()
+
+# columns MetFrag reads for the candidates found in the mass window
+FETCHED_COLUMNS = (
+    "identifier",
+    "inchi",
+    "monoisotopic_mass",
+    "formula",
+    "inchikey_1",
+    "inchikey_2",
+    "smiles",
+    "name",
+)
+
+
+def replay_queries(
+    cursor,
+    table: str,
+    windows: T.List[T.Tuple[float, float]],
+    warmup: int = 100,
+) -> pd.DataFrame:
+    """
+    Replay MetFrag's candidate queries against a table and time them.
+
+    For every mass window, MetFrag selects the identifiers in the window and then
+    fetches the candidate rows by identifier.
+
+    Args:
+        cursor: psycopg2 cursor.
+        table (str): The candidate table.
+        windows (List[Tuple[float, float]]): (low, high) monoisotopic mass of every query.
+        warmup (int): Number of windows replayed untimed first.
+
+    Returns:
+        pd.DataFrame: Number of candidates and latencies (ms) of every window.
+    """
+    window_query = (
+        f"SELECT identifier FROM {table} WHERE monoisotopic_mass BETWEEN %s AND %s"
+    )
+    fetch_query = (
+        f"SELECT {', '.join(FETCHED_COLUMNS)} FROM {table} WHERE identifier IN %s"
+    )
+
+    def run(low: float, high: float) -> T.Tuple[int, float, float]:
+        start = time.perf_counter()
+        cursor.execute(window_query, (low, high))
+        identifiers = tuple(row[0] for row in cursor.fetchall())
+        selected = time.perf_counter()
+        if identifiers:
+            cursor.execute(fetch_query, (identifiers,))
+            cursor.fetchall()
+        fetched = time.perf_counter()
+        return len(identifiers), (selected - start) * 1e3, (fetched - start) * 1e3
+
+    for low, high in windows[:warmup]:
+        run(low, high)
+    return pd.DataFrame(
+        [run(low, high) for low, high in tqdm(windows, desc=table, leave=False)],
+        columns=["n_candidates", "window_ms", "total_ms"],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark MetFrag's candidate queries on MassSpecGym precursors."
+    )
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        default=[TABLE_NAME],
+        help="Candidate tables to compare, e.g. built with different --index_layout (default: lotus_expanded)",
+    )
+    parser.add_argument(
+        "--n_queries",
+        type=int,
+        default=None,
+        help="Number of precursors to replay, sampled at random (default: all)",
+    )
+    parser.add_argument(
+        "--ppm",
+        type=float,
+        default=10.0,
+        help="Relative mass deviation of the windows, as DatabaseSearchRelativeMassDeviation (default: 10)",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=100,
+        help="Number of untimed queries run first on each table (default: 100)",
+    )
+    args = parser.parse_args()
+
+    massspecgym = load_massspecgym()
+    precursors = massspecgym[["precursor_mz", "adduct"]]
+    if args.n_queries is not None and args.n_queries < len(precursors):
+        precursors = precursors.sample(args.n_queries, random_state=42)
+    masses = neutral_masses(precursors["precursor_mz"], precursors["adduct"])
+    deviation = masses * args.ppm * 1e-6
+    windows = np.stack([masses - deviation, masses + deviation], axis=1).tolist()
+
+    conn = connect()
+    conn.autocommit = True
+    rows = []
+    with conn.cursor() as cursor:
+        for table in args.tables:
+            latencies = replay_queries(cursor, table, windows, args.warmup)
+            rows.append(
+                {
+                    "table": table,
+                    "n_queries": len(latencies),
+                    "mean_candidates": latencies["n_candidates"].mean(),
+                    "window_p50_ms": latencies["window_ms"].quantile(0.5),
+                    "window_p99_ms": latencies["window_ms"].quantile(0.99),
+                    "total_p50_ms": latencies["total_ms"].quantile(0.5),
+                    "total_p99_ms": latencies["total_ms"].quantile(0.99),
+                }
+            )
+    conn.close()
+
+    results = pd.DataFrame(rows).set_index("table")
+    print(results.to_string(float_format="{:.3f}".format))
+    results.to_csv("candidate_query_latency.csv")
+
+
+if __name__ == "__main__":
+    main()
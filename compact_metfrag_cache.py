@@ -0,0 +1,37 @@
+import argparse
+
+from ms2mol_evaluation.results_dataset import RESULTS_DATASET_PATH, compact_results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge the per-spectrum MetFrag results of the cache into a Parquet dataset."
+    )
+    parser.add_argument(
+        "--path",
+        default=str(RESULTS_DATASET_PATH),
+        help=f"Directory of the Parquet dataset (default: {RESULTS_DATASET_PATH})",
+    )
+    parser.add_argument(
+        "--spectra_per_file",
+        type=int,
+        default=10000,
+        help="Number of spectra per Parquet file (default: 10000)",
+    )
+    parser.add_argument(
+        "--remove_cache",
+        action="store_true",
+        help="Delete the per-spectrum cache directories once compacted",
+    )
+    args = parser.parse_args()
+
+    n_spectra = compact_results(
+        args.path,
+        spectra_per_file=args.spectra_per_file,
+        remove_cache=args.remove_cache,
+    )
+    print(f"Compacted the results of {n_spectra} spectra into {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,178 +1,430 @@
-import gc
-import os
+import argparse
+import hashlib
 import typing as T
+from functools import partial
 
 import pandas as pd
-import polars as pl
-import psycopg2
 from dotenv import load_dotenv
 from joblib import Parallel, delayed
 from pymongo import MongoClient
-from rdkit.Chem import Mol, MolToInchiKey
+from pymongo.collection import Collection
+from rdkit.Chem import InchiToInchiKey, MolFromSmiles, MolToInchi, MolToSmiles
 from rdkit.Chem.Descriptors import ExactMolWt
 from rdkit.Chem.rdMolDescriptors import CalcMolFormula
-from skfp.preprocessing import (
-    MolFromSmilesTransformer,
-    MolToInchiTransformer,
-    MolToSmilesTransformer,
-)
 from tqdm import tqdm
 
-from ms2mol_evaluation.lotus_expanded import create_insert_query, create_table_query
+from ms2mol_evaluation.lotus import write_local_database
+from ms2mol_evaluation.lotus_expanded import (
+    INDEX_LAYOUTS,
+    TABLE_NAME,
+    create_index_query,
+    create_table_query,
+)
+from ms2mol_evaluation.postgres import (
+    bulk_load,
+    connect,
+    fetch_values,
+    last_build,
+    record_build,
+    table_exists,
+    upsert,
+)
 
 load_dotenv()
 
 
-def fetch_lotus_expanded_from_mongodb() -> pl.DataFrame:
+def get_lotus_expanded_collection() -> Collection:
     client = MongoClient()
     db = client.get_database("lotus_mines")
-    collection = db.get_collection("compounds")
-    df = pl.from_dicts(collection.find(), infer_schema_length=500)
-    return df
+    return db.get_collection("compounds")
 
 
-def convert_smiles_to_mol(
-    smiles: T.List[str],
-    n_jobs: int,
-    valid_only: bool = True,
-) -> T.List[Mol]:
-    transformer = MolFromSmilesTransformer(
-        n_jobs=n_jobs, verbose=True, valid_only=valid_only
+def iter_smiles_batches(
+    collection: Collection,
+    batch_size: int = 100000,
+) -> T.Iterator[T.List[str]]:
+    """
+    Lazily read the SMILES of the expanded structures, `batch_size` at a time.
+
+    The cursor is projected on the SMILES field, so no other field of the
+    documents is transferred, and only one batch is held in memory.
+    """
+    cursor = collection.find(
+        {"SMILES": {"$ne": None}},
+        projection={"SMILES": True, "_id": False},
+        batch_size=batch_size,
     )
-    return transformer.transform(smiles)
+    batch = []
+    for document in cursor:
+        batch.append(document["SMILES"])
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# structures left after each stage of create_dataframe_for_db
+BUILD_STAGES = (
+    "structures",
+    "unique_smiles",
+    "unique_skeletons",
+    "inchikeys",
+    "new_inchikey1",
+)
 
 
-def get_exact_masses(
-    mols: T.List[Mol],
-) -> T.List[float]:
+def skeleton_keys(smiles: T.List[str]) -> T.List[T.Optional[str]]:
     """
-    Get exact masses for a list of RDKit Mol objects.
+    Cheap duplicate key: the canonical SMILES without stereo and isotopes.
+
+    Structures with the same skeleton key have the same InChIKey1, since the
+    first InChIKey block only hashes the formula and connectivity. None for
+    SMILES that cannot be parsed.
     """
-    return [
-        ExactMolWt(mol)
-        for mol in tqdm(mols, desc="Calculating monoisotopic masses", leave=False)
-        if mol is not None
-    ]
+    keys = []
+    for smi in smiles:
+        mol = MolFromSmiles(smi)
+        keys.append(None if mol is None else MolToSmiles(mol, isomericSmiles=False))
+    return keys
 
 
-def get_mol_formulas(
-    mols: T.List[Mol],
-) -> T.List[str]:
+def inchi_keys(smiles: T.List[str]) -> T.List[T.Tuple[str, str]]:
     """
-    Get molecular formulas for a list of RDKit Mol objects.
+    Returns the InChI and InChIKey of each SMILES, empty strings if it has no InChI.
     """
-    return [
-        CalcMolFormula(mol)
-        for mol in tqdm(mols, desc="Calculating mol formulas", leave=False)
-        if mol is not None
-    ]
+    keys = []
+    for smi in smiles:
+        inchi = MolToInchi(MolFromSmiles(smi))
+        keys.append((inchi, InchiToInchiKey(inchi) or "") if inchi else ("", ""))
+    return keys
 
 
-def get_inchis(
-    mols: T.List[Mol],
-    n_jobs: int = -1,
-    batch_size: int = 5000,
-) -> T.List[str]:
+def featurize_smiles(
+    smiles: T.List[str],
+    inchis: T.List[str],
+    inchikeys: T.List[str],
+) -> pd.DataFrame:
     """
-    Get InChI strings for a list of RDKit Mol objects.
+    Compute the remaining candidate columns of a chunk of structures.
+
+    Each SMILES is parsed inside the worker and all descriptors are computed
+    from the same molecule, so no Mol object is ever pickled.
+
+    Args:
+        smiles (List[str]): SMILES of the structures.
+        inchis (List[str]): Their InChI.
+        inchikeys (List[str]): Their InChIKey.
+
+    Returns:
+        pd.DataFrame: The MetFrag columns of the structures.
     """
-    transformer = MolToInchiTransformer(
-        n_jobs=n_jobs, batch_size=batch_size, verbose=True
+    masses, formulas, canonical_smiles = [], [], []
+    for smi in smiles:
+        mol = MolFromSmiles(smi)
+        masses.append(ExactMolWt(mol))
+        formulas.append(CalcMolFormula(mol))
+        canonical_smiles.append(MolToSmiles(mol))
+    key_blocks = [inchikey.split("-") for inchikey in inchikeys]
+    return pd.DataFrame(
+        {
+            "Identifier": inchikeys,
+            "InChI": inchis,
+            "MonoisotopicMass": pd.Series(masses, dtype=float),
+            "MolecularFormula": formulas,
+            "InChIKey1": [blocks[0] for blocks in key_blocks],
+            "InChIKey2": [blocks[1] for blocks in key_blocks],
+            "SMILES": canonical_smiles,
+            "Name": inchikeys,
+            "InChIKey3": [blocks[2] for blocks in key_blocks],
+        }
     )
-    return transformer.transform(mols)
 
 
-def mol_to_inchikey(
-    mol: Mol,
-) -> str:
-    """
-    Convert a single RDKit Mol object to its InChIKey.
-    """
-    if mol is None:
-        raise ValueError("Input molecule is None.")
-    inchikey = MolToInchiKey(mol)
-    return inchikey
+def map_chunks(
+    function: T.Callable[..., T.List],
+    *columns: T.List,
+    n_jobs: int = -1,
+    chunk_size: int = 5000,
+    desc: T.Optional[str] = None,
+) -> T.List:
+    """Apply a per-chunk worker function in parallel and concatenate its results."""
+    length = len(columns[0])
+    chunks = Parallel(n_jobs=n_jobs)(
+        delayed(function)(*(column[i : i + chunk_size] for column in columns))
+        for i in tqdm(range(0, length, chunk_size), desc=desc, leave=False)
+    )
+    return [item for chunk in chunks for item in chunk]
 
 
-def get_inchikeys(
-    mols: T.List[Mol],
+def create_dataframe_for_db(
+    smiles: T.List[str],
     n_jobs: int = -1,
-) -> T.List[str]:
+    chunk_size: int = 5000,
+    seen_inchikeys: T.Optional[T.Set[str]] = None,
+    counters: T.Optional[T.Dict[str, int]] = None,
+) -> pd.DataFrame:
     """
-    Get InChIKey strings for a list of RDKit Mol objects.
+    Featurize SMILES in parallel chunks into a MetFrag formatted candidate table.
+
+    Duplicates are dropped before the expensive descriptors are computed, in
+    order of cost: identical SMILES strings, then identical skeleton keys
+    (stereoisomers), then identical InChIKey1 (e.g. tautomers), keeping the
+    first structure each time. Mass, formula and canonical SMILES are only
+    computed for the remaining structures. The result is the same as
+    featurizing everything and calling `drop_duplicates("InChIKey1")`.
+
+    Args:
+        smiles (List[str]): SMILES of the structures.
+        n_jobs (int): Number of processes.
+        chunk_size (int): Number of SMILES featurized per task.
+        seen_inchikeys (Set[str], optional): InChIKey1 already loaded, dropped
+            as well and updated with the new ones.
+        counters (Dict[str, int], optional): Incremented with the number of
+            structures left after each of the `BUILD_STAGES`.
     """
-    inchikeys = Parallel(n_jobs=n_jobs)(
-        delayed(mol_to_inchikey)(mol) for mol in tqdm(mols)
+    counters = {} if counters is None else counters
+    seen_inchikeys = set() if seen_inchikeys is None else seen_inchikeys
+    counters["structures"] = counters.get("structures", 0) + len(smiles)
+
+    smiles = list(dict.fromkeys(smiles))
+    counters["unique_smiles"] = counters.get("unique_smiles", 0) + len(smiles)
+
+    skeletons = map_chunks(
+        skeleton_keys, smiles, n_jobs=n_jobs, chunk_size=chunk_size, desc="Skeletons"
+    )
+    first = {}
+    for smi, skeleton in zip(smiles, skeletons):
+        if skeleton is not None:
+            first.setdefault(skeleton, smi)
+    smiles = list(first.values())
+    counters["unique_skeletons"] = counters.get("unique_skeletons", 0) + len(smiles)
+
+    keys = map_chunks(
+        inchi_keys, smiles, n_jobs=n_jobs, chunk_size=chunk_size, desc="InChIKeys"
     )
-    return inchikeys
+    counters["inchikeys"] = counters.get("inchikeys", 0) + sum(
+        1 for _, inchikey in keys if inchikey
+    )
+    survivors = []
+    for smi, (inchi, inchikey) in zip(smiles, keys):
+        inchikey1 = inchikey.split("-")[0]
+        if inchikey and inchikey1 not in seen_inchikeys:
+            seen_inchikeys.add(inchikey1)
+            survivors.append((smi, inchi, inchikey))
+    counters["new_inchikey1"] = counters.get("new_inchikey1", 0) + len(survivors)
 
+    smiles, inchis, inchikeys = (
+        map(list, zip(*survivors)) if survivors else ([], [], [])
+    )
+    chunks = Parallel(n_jobs=n_jobs)(
+        delayed(featurize_smiles)(
+            smiles[i : i + chunk_size],
+            inchis[i : i + chunk_size],
+            inchikeys[i : i + chunk_size],
+        )
+        for i in tqdm(
+            range(0, len(smiles), chunk_size), desc="Featurizing", leave=False
+        )
+    )
+    if not chunks:
+        return featurize_smiles([], [], [])
+    return pd.concat(chunks, ignore_index=True)
 
-def get_smiles(
-    mols: T.List[Mol],
+
+def iter_candidate_batches(
+    smiles_batches: T.Iterable[T.List[str]],
     n_jobs: int = -1,
-) -> T.List[str]:
-    """
-    Get SMILES strings for a list of RDKit Mol objects.
-    """
-    transformer = MolToSmilesTransformer(verbose=True, n_jobs=n_jobs)
-    smiles = transformer.transform(mols)
-    return smiles
-
-
-def create_dataframe_for_db(mols: T.List[Mol]) -> pd.DataFrame:
-    monoisotopic_masses = get_exact_masses(mols)
-    formulas = get_mol_formulas(mols)
-    inchis = get_inchis(mols)
-    inchikeys = get_inchikeys(mols)
-    smiles = get_smiles(mols)
-
-    data = (
-        pd.DataFrame(
-            {
-                "Identifier": inchikeys,
-                "InChI": inchis,
-                "MonoisotopicMass": monoisotopic_masses,
-                "MolecularFormula": formulas,
-                "InChIKey1": list(map(lambda x: x.split("-")[0], inchikeys)),
-                "InChIKey2": list(map(lambda x: x.split("-")[1], inchikeys)),
-                "SMILES": smiles,
-                "Name": inchikeys,
-                "InChIKey3": list(map(lambda x: x.split("-")[2], inchikeys)),
-            }
+    counters: T.Optional[T.Dict[str, int]] = None,
+    seen_inchikeys: T.Optional[T.Set[str]] = None,
+) -> T.Iterator[pd.DataFrame]:
+    """
+    Featurize SMILES batches into MetFrag formatted candidate batches.
+
+    A structure is only kept the first time its InChIKey1 is seen, across all
+    batches, as `drop_duplicates("InChIKey1")` does on the full table. Only the
+    InChIKey1 values seen so far are kept between batches. Structures whose
+    InChIKey1 is in `seen_inchikeys` from the start (e.g. already in the
+    database) are never featurized.
+    """
+    seen_inchikeys = set() if seen_inchikeys is None else seen_inchikeys
+    for smiles in smiles_batches:
+        yield create_dataframe_for_db(
+            smiles,
+            n_jobs=n_jobs,
+            seen_inchikeys=seen_inchikeys,
+            counters=counters,
         )
-        .drop_duplicates("InChIKey1")
-        .reset_index(drop=True)
+
+
+class SourceDigest:
+    """
+    Order-independent hash and count of the source SMILES.
+
+    The hash is the sum of the hashes of the SMILES, so the same snapshot gives
+    the same hash whatever order the documents are returned in.
+    """
+
+    def __init__(self):
+        self._sum = 0
+        self.count = 0
+
+    def update(self, smiles: T.List[str]) -> None:
+        for smi in smiles:
+            digest = hashlib.blake2b(smi.encode(), digest_size=16).digest()
+            self._sum = (self._sum + int.from_bytes(digest, "little")) % 2**128
+        self.count += len(smiles)
+
+    def hexdigest(self) -> str:
+        return f"{self._sum:032x}"
+
+
+def track_batches(
+    batches: T.Iterable[T.List[str]],
+    digest: SourceDigest,
+) -> T.Iterator[T.List[str]]:
+    for batch in batches:
+        digest.update(batch)
+        yield batch
+
+
+def print_counters(counters: T.Dict[str, int]) -> None:
+    """
+    Print the structures left after each stage and the work avoided by deduplicating first.
+    """
+    total = counters.get("structures", 0)
+    for stage in BUILD_STAGES:
+        count = counters.get(stage, 0)
+        share = count / total if total else 0.0
+        print(f"{stage:>16}: {count:>12} ({share:.1%})")
+    print(
+        f"InChI computations avoided: {total - counters.get('unique_skeletons', 0)}, "
+        f"descriptor computations avoided: {total - counters.get('new_inchikey1', 0)}"
+    )
+
+
+def update_table(
+    conn,
+    collection: Collection,
+    table: str,
+    batch_size: int,
+    counters: T.Dict[str, int],
+) -> int:
+    """
+    Add the new structures of the collection to an existing candidate table.
+
+    The source is hashed first, and nothing is done if the table was last built
+    from the same snapshot. Otherwise only the structures whose InChIKey1 is not
+    yet in the table are featurized and upserted, and the build is recorded in
+    the build manifest.
+
+    Returns:
+        int: Number of added candidates.
+    """
+    digest = SourceDigest()
+    for batch in iter_smiles_batches(collection, batch_size):
+        digest.update(batch)
+    previous = last_build(conn, table)
+    if previous is not None and previous["source_hash"] == digest.hexdigest():
+        print(f"{table} is up to date with the source ({digest.count} structures)")
+        return 0
+
+    existing = fetch_values(conn, table, "inchikey_1")
+    print(f"{len(existing)} InChIKey1 already in {table}")
+    batches = iter_candidate_batches(
+        iter_smiles_batches(collection, batch_size),
+        counters=counters,
+        seen_inchikeys=existing,
     )
-    return data
+    n_rows = upsert(conn, batches, table)
+    record_build(conn, table, "incremental", digest.hexdigest(), digest.count, n_rows)
+    print_counters(counters)
+    print(f"Added {n_rows} candidates to {table}")
+    return n_rows
 
 
 def main():
-    df = fetch_lotus_expanded_from_mongodb()
-    mols = convert_smiles_to_mol(df["SMILES"].to_list(), n_jobs=-1, valid_only=True)
-    del df
-    df = create_dataframe_for_db(mols)
-    del mols
-    gc.collect()
-
-    conn = psycopg2.connect(
-        database=os.getenv("LOTUS_DB_PGDATABASE"),
-        host=os.getenv("LOTUS_DB_PGHOST"),
-        port=os.getenv("LOTUS_DB_PGPORT"),
-        user=os.getenv("LOTUS_DB_POSTGRES_USER"),
-        password=os.getenv("LOTUS_DB_POSTGRES_PASSWORD"),
-    )
-    conn.autocommit = True
-    cursor = conn.cursor()
-
-    table_query = create_table_query()
-    cursor.execute(table_query)
-
-    insert_query = create_insert_query()
-    data = df.values.tolist()
-    batch_size = 1000
-    for i in tqdm(range(0, len(data), batch_size)):
-        batch = data[i : i + batch_size]
-        cursor.executemany(insert_query, batch)
+    parser = argparse.ArgumentParser(
+        description="Build the lotus_expanded candidate database."
+    )
+    parser.add_argument(
+        "--database_type",
+        choices=["Postgres", "LocalCSV", "LocalPSV"],
+        default="Postgres",
+        help="Where to store the candidates (default: Postgres)",
+    )
+    parser.add_argument(
+        "--table_name",
+        default=TABLE_NAME,
+        help=f"Name of the Postgres table (default: {TABLE_NAME})",
+    )
+    parser.add_argument(
+        "--index_layout",
+        choices=INDEX_LAYOUTS,
+        default="mass",
+        help="Indexes of the Postgres table, 'covering' lets the mass-window queries be answered from the index (default: mass)",
+    )
+    parser.add_argument(
+        "--partition_width",
+        type=float,
+        default=None,
+        help="Partition the Postgres table by monoisotopic mass ranges of this many Da (default: not partitioned)",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=100000,
+        help="Number of structures read, featurized and loaded at once (default: 100000)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only featurize and add the structures whose InChIKey1 is not yet in the Postgres table",
+    )
+    args = parser.parse_args()
+    if args.incremental and args.database_type != "Postgres":
+        parser.error("--incremental requires --database_type Postgres.")
+
+    collection = get_lotus_expanded_collection()
+    counters = {}
+    if args.incremental:
+        conn = connect()
+        if table_exists(conn, args.table_name):
+            update_table(conn, collection, args.table_name, args.batch_size, counters)
+            conn.close()
+            return
+        print(f"{args.table_name} does not exist yet, building it from scratch")
+        conn.close()
+
+    digest = SourceDigest()
+    batches = iter_candidate_batches(
+        track_batches(iter_smiles_batches(collection, args.batch_size), digest),
+        counters=counters,
+    )
+
+    if args.database_type != "Postgres":
+        write_local_database(batches, TABLE_NAME, args.database_type)
+        print_counters(counters)
+        return
+
+    conn = connect()
+    n_rows = bulk_load(
+        conn,
+        batches,
+        args.table_name,
+        partial(create_table_query, partition_width=args.partition_width),
+        partial(
+            create_index_query,
+            layout=args.index_layout,
+            partition_width=args.partition_width,
+        ),
+    )
+    record_build(
+        conn, args.table_name, "full", digest.hexdigest(), digest.count, n_rows
+    )
+    conn.close()
+    print_counters(counters)
+    print(f"Loaded {n_rows} candidates into {args.table_name}")
 
 
 if __name__ == "__main__":
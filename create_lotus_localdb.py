@@ -0,0 +1,24 @@
+import argparse
+
+from ms2mol_evaluation.lotus import load_lotus_for_metfrag, write_local_database
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write LOTUS as a file-backed MetFrag candidate database."
+    )
+    parser.add_argument(
+        "--database_type",
+        choices=["LocalCSV", "LocalPSV"],
+        default="LocalCSV",
+        help="MetFrag local database format (default: LocalCSV)",
+    )
+    args = parser.parse_args()
+
+    df = load_lotus_for_metfrag()
+    path = write_local_database(df, "lotus", args.database_type)
+    print(f"Wrote {len(df)} candidates to {path}")
+
+
+if __name__ == "__main__":
+    main()
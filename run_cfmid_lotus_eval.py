@@ -1,73 +1,115 @@
-import os
+import argparse
 import typing as T
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
-from matchms import calculate_scores
-from matchms.similarity import CosineGreedy, PrecursorMzMatch
+import pyarrow.dataset as ds
+from joblib import Parallel, delayed
 from tqdm import tqdm
 
 from ms2mol_evaluation.isdb import download_isdb, filter_massspecgym_spectra, load_isdb
 from ms2mol_evaluation.massspecgym import load_massspecgym, to_spectra
+from ms2mol_evaluation.precursor_index import PrecursorIndex
+from ms2mol_evaluation.similarity import cosine_greedy_pairs
 from ms2mol_evaluation.spectrum import Spectrum
+from ms2mol_evaluation.spectrum_store import SpectrumStore
+
+OUTPUT_DIR = Path("lotus_cfmid_scores")
+
+
+def score_chunk(
+    chunk_number: int,
+    chunk: T.List[Spectrum],
+    first_feature_id: int,
+    isdb_store: SpectrumStore,
+    isdb_index: PrecursorIndex,
+) -> Path:
+    """
+    Score a chunk of MassSpecGym spectra against ISDB and write it as a Parquet part.
+
+    The part is only renamed into place once complete, so a chunk whose part
+    exists is finished and is skipped when the run is restarted.
+    """
+    part = OUTPUT_DIR / f"part-{chunk_number:05d}.parquet"
+    if part.exists():
+        return part
+
+    # only pairs within 10 ppm are compared, same as PrecursorMzMatch(10, "ppm")
+    idx_row, idx_col = isdb_index.match(
+        [s.get("precursor_mz") for s in chunk],
+        tolerance=10.0,
+        tolerance_type="ppm",
+    )
+    keep = idx_row < idx_col
+    idx_row, idx_col = idx_row[keep], idx_col[keep]
+    # same scores as CosineGreedy(tolerance=0.01).pair(chunk[x], isdb[y])
+    scores = cosine_greedy_pairs(chunk, isdb_store, idx_row, idx_col, tolerance=0.01)
+
+    def chunk_metadata(key: str) -> np.ndarray:
+        return np.array([s.get(key) for s in chunk], dtype=object)[idx_row]
+
+    def isdb_metadata(key: str) -> np.ndarray:
+        return np.array(isdb_store.get(key, indices=idx_col), dtype=object)
+
+    # if (msms_score > 0.2) and (n_matches > 6):
+    df = pd.DataFrame(
+        {
+            "cosine_similarity": scores["score"],
+            "matched_peaks": scores["matches"],
+            "feature_id": idx_row + first_feature_id,
+            "reference_id": idx_col,  # code copied from https://github.com/mandelbrot-project/met_annot_enhancer/blob/f8346fd3f7a9775d1d6638cf091d019167ba7ce1/src/dev/spectral_lib_matcher.py#L175
+            "inchikey_isdb": isdb_metadata("compound_name"),
+            "smiles_isdb": isdb_metadata("smiles"),
+            "inchikey_msg": chunk_metadata("inchikey"),
+            "smiles_msg": chunk_metadata("smiles"),
+            "adduct": chunk_metadata("adduct"),
+            "instrument": chunk_metadata("instrument_type"),
+            "identifier": chunk_metadata("identifier"),
+        }
+    )
+    # readers of the directory skip files starting with "_", e.g. a part left by a crash
+    tmp_part = part.with_name(f"_{part.name}.tmp")
+    df.to_parquet(tmp_part, index=False)
+    tmp_part.rename(part)
+    return part
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="Run the CFM-ID (ISDB) evaluation with configurable CPU usage."
+    )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=-1,
+        help="Number of CPUs to use (default: all available)",
+    )
+    args = parser.parse_args()
+
     download_isdb()
     massspecgym = load_massspecgym()
-    spectra: T.List[Spectrum] = to_spectra(massspecgym)
-    isdb: T.List[Spectrum] = load_isdb()
+    store: SpectrumStore = to_spectra(massspecgym)
+    isdb_store: SpectrumStore = load_isdb()
 
     # we filter the MassSpecGym spectra to only include those present in ISDB
-    spectra = filter_massspecgym_spectra(spectra, isdb, hydrogen_adduct_only=True)
+    spectra = filter_massspecgym_spectra(store, isdb_store, hydrogen_adduct_only=True)
 
-    similarity_score = PrecursorMzMatch(tolerance=10.0, tolerance_type="ppm")
+    isdb_index = PrecursorIndex.from_spectra(isdb_store)
     interval = 1000
     chunks_query = [spectra[x : x + interval] for x in range(0, len(spectra), interval)]
 
-    cosinegreedy = CosineGreedy(tolerance=0.01)
-
-    scans_id_map = {}
-    i = 0
-    for chunk_number, chunk in enumerate(tqdm(chunks_query)):
-        scores = calculate_scores(chunk, isdb, similarity_score)
-        idx_row = scores.scores[:, :][0]
-        idx_col = scores.scores[:, :][1]
-
-        for _ in chunk:
-            scans_id_map[i] = i
-            i += 1
-
-        data = []
-        for x, y in zip(idx_row, idx_col):
-            if x >= y:
-                continue
-            msms_score, n_matches = cosinegreedy.pair(chunk[x], isdb[y])[()]
-            # if (msms_score > 0.2) and (n_matches > 6):
-
-            feature_id = scans_id_map[int(x) + int(interval * chunk_number)]
-            data.append(
-                {
-                    "cosine_similarity": msms_score,
-                    "matched_peaks": n_matches,
-                    "feature_id": feature_id,
-                    "reference_id": y,  # code copied from https://github.com/mandelbrot-project/met_annot_enhancer/blob/f8346fd3f7a9775d1d6638cf091d019167ba7ce1/src/dev/spectral_lib_matcher.py#L175
-                    "inchikey_isdb": isdb[y].get("compound_name"),
-                    "smiles_isdb": isdb[y].get("smiles"),
-                    "inchikey_msg": chunk[x].get("inchikey"),
-                    "smiles_msg": chunk[x].get("smiles"),
-                    "adduct": chunk[x].get("adduct"),
-                    "instrument": chunk[x].get("instrument_type"),
-                    "identifier": chunk[x].get("identifier"),
-                }
-            )
-        df = pd.DataFrame(data)
-        df.to_csv(
-            "lotus_cfmid_scores.csv",
-            mode="a",
-            header=not os.path.exists("lotus_cfmid_scores.csv"),
-            sep=",",
-            index=False,
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    Parallel(n_jobs=args.n_jobs)(
+        delayed(score_chunk)(
+            chunk_number, chunk, interval * chunk_number, isdb_store, isdb_index
         )
+        for chunk_number, chunk in enumerate(tqdm(chunks_query))
+    )
+
+    # only the Parquet footers are read to count the rows
+    n_pairs = ds.dataset(OUTPUT_DIR, format="parquet").count_rows()
+    print(f"{n_pairs} scored pairs in {OUTPUT_DIR}")
 
 
 if __name__ == "__main__":
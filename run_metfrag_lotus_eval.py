@@ -1,20 +1,34 @@
 import argparse
+import os
 import typing as T
 
+import numpy as np
 import pandas as pd
 from downloaders import BaseDownloader
-from joblib import Parallel, delayed
-from tqdm import tqdm
 
+from ms2mol_evaluation.candidates import CandidateIndex
+from ms2mol_evaluation.evaluation import evaluation_summary, generate_full_results
 from ms2mol_evaluation.isdb import download_isdb, filter_massspecgym_spectra, load_isdb
+from ms2mol_evaluation.lotus import load_lotus_for_metfrag, write_local_database
 from ms2mol_evaluation.massspecgym import load_massspecgym, to_spectra
-from ms2mol_evaluation.metfrag import run_metfrag
+from ms2mol_evaluation.metfrag import SCRATCH_DIR_ENV
+from ms2mol_evaluation.metfrag_config import local_database_path
+from ms2mol_evaluation.scheduling import SCHEDULES, predict_costs
 from ms2mol_evaluation.spectrum import Spectrum
-from ms2mol_evaluation.utils import (
-    analyze_results,
-    convert_evaluation_results,
-    generate_full_results,
-)
+from ms2mol_evaluation.spectrum_store import SpectrumStore
+from ms2mol_evaluation.streaming import run_streaming_evaluation
+
+
+def retrieve_candidates(
+    spectra: T.List[Spectrum],
+    table: str,
+    database_type: str,
+) -> T.Tuple[T.List[T.Dict[str, T.Any]], np.ndarray]:
+    index = CandidateIndex.from_local_database(table, database_type)
+    counts = index.candidate_counts(spectra)
+    print(f"Candidates per spectrum in {table}:")
+    print(pd.Series(counts).describe().to_string())
+    return index.write_candidate_files(spectra, database_type=database_type), counts
 
 
 def main():
@@ -27,51 +41,106 @@ def main():
         default=-1,
         help="Number of CPUs to use (default: all available)",
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=8,
+        help="Number of spectra sent to MetFrag per job (default: 8)",
+    )
+    parser.add_argument(
+        "--database_type",
+        choices=["Postgres", "LocalCSV", "LocalPSV"],
+        default="Postgres",
+        help="Candidate database used by MetFrag (default: Postgres)",
+    )
+    parser.add_argument(
+        "--candidate_index",
+        action="store_true",
+        help="Retrieve candidates in memory and give MetFrag one small candidate file per spectrum (requires a local --database_type)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default="lotus_metfrag_ranks.checkpoint.csv",
+        help="Ranks of the evaluated spectra, a restart only runs the others (default: lotus_metfrag_ranks.checkpoint.csv)",
+    )
+    parser.add_argument(
+        "--report_every",
+        type=float,
+        default=60.0,
+        help="Seconds between running top-k estimates (default: 60)",
+    )
+    parser.add_argument(
+        "--schedule",
+        choices=SCHEDULES,
+        default="random",
+        help="Submit the spectra in a random order for unbiased running estimates, or with the longest predicted runtime first (default: random)",
+    )
+    parser.add_argument(
+        "--scratch_dir",
+        default=None,
+        help="Where the workers write the MetFrag configs and peak lists, e.g. a tmpfs such as /dev/shm (default: the system temporary directory)",
+    )
     args = parser.parse_args()
+    if args.scratch_dir is not None:
+        # read by the joblib workers, which inherit the environment
+        os.environ[SCRATCH_DIR_ENV] = args.scratch_dir
+    if args.candidate_index and args.database_type == "Postgres":
+        parser.error("--candidate_index requires a local --database_type.")
     _ = BaseDownloader(auto_extract=False).download(
         "https://github.com/ipb-halle/MetFragRelaunched/releases/download/v2.6.6/MetFragCommandLine-2.6.6.jar",
         "MetFragCommandLine-2.6.6.jar",
     )
 
     massspecgym = load_massspecgym()
-    spectra: T.List[Spectrum] = to_spectra(massspecgym)
+    store: SpectrumStore = to_spectra(massspecgym)
     download_isdb()
-    isdb: T.List[Spectrum] = load_isdb()
-    spectra = filter_massspecgym_spectra(spectra, isdb, hydrogen_adduct_only=False)
+    isdb: SpectrumStore = load_isdb()
+    spectra = filter_massspecgym_spectra(store, isdb, hydrogen_adduct_only=False)
 
-    results = Parallel(n_jobs=args.n_jobs)(
-        delayed(run_metfrag)(spectrum) for spectrum in tqdm(spectra)
-    )
+    config_params = None
+    if args.database_type != "Postgres":
+        config_params = {"MetFragDatabaseType": args.database_type}
+        if not local_database_path("lotus", args.database_type).exists():
+            write_local_database(load_lotus_for_metfrag(), "lotus", args.database_type)
 
-    # we now check the top 1, 5, 10 and 20 results
-    # we also want to check if there is a difference between H adduct or Na adduct
-    # we also want to check if there is a difference between orbitrap and qtof
-    resulting_dataframes = [i[2] for i in results]
+    candidate_counts = None
+    if args.candidate_index:
+        config_params, candidate_counts = retrieve_candidates(
+            spectra, "lotus", args.database_type
+        )
+    else:
+        config_params = [config_params] * len(spectra)
 
-    res = analyze_results(spectra, resulting_dataframes)
-    metrics: T.Dict[str, int] = res.pop("metrics")
-    for key, value in metrics.items():
-        if "_h" in key:
-            metrics[key] = metrics[key] / res["n_spectrum_h"]
-        elif "_na" in key:
-            metrics[key] = metrics[key] / res["n_spectrum_na"]
-        elif "_orbitrap" in key:
-            metrics[key] = metrics[key] / res["n_spectrum_orbitrap"]
-        elif "_qtof" in key:
-            metrics[key] = metrics[key] / res["n_spectrum_qtof"]
+    costs = None
+    costs_in_seconds = False
+    if args.schedule == "cost":
+        costs, cost_model = predict_costs(spectra, candidate_counts)
+        costs_in_seconds = cost_model.is_fitted
+        if cost_model.is_fitted:
+            print(f"Cost model fitted on {cost_model.n_samples} recorded runtimes")
         else:
-            metrics[key] = metrics[key] / res["n_total"]
+            print("No recorded runtimes yet, ranking the spectra by their default cost")
 
-    out_df = pd.DataFrame.from_dict(
-        metrics,
-        orient="index",
-    ).T
+    # we now check the top 1, 5, 10 and 20 results
+    # we also want to check if there is a difference between H adduct or Na adduct
+    # we also want to check if there is a difference between orbitrap and qtof
+    ranks = run_streaming_evaluation(
+        spectra,
+        config_params,
+        checkpoint_path=args.checkpoint,
+        n_jobs=args.n_jobs,
+        batch_size=args.batch_size,
+        report_every=args.report_every,
+        costs=costs,
+        costs_in_seconds=costs_in_seconds,
+        summary_path="lotus_metfrag_top_n.running.csv",
+    )
 
-    convert_evaluation_results(out_df).to_csv(
+    evaluation_summary(ranks).to_csv(
         "lotus_metfrag_top_n.csv",
     )
 
-    df = generate_full_results(spectra, resulting_dataframes)
+    df = generate_full_results(ranks)
     df.to_csv("lotus_metfrag_scores.csv", index=False)
 
 
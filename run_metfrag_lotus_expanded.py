@@ -1,19 +1,33 @@
 import argparse
+import os
 import typing as T
 
+import numpy as np
 import pandas as pd
 from downloaders import BaseDownloader
-from joblib import Parallel, delayed
 from tqdm import tqdm
 
+from ms2mol_evaluation.candidates import CandidateIndex
+from ms2mol_evaluation.evaluation import evaluation_summary, generate_full_results
 from ms2mol_evaluation.massspecgym import load_massspecgym, to_spectra
-from ms2mol_evaluation.metfrag import run_metfrag
+from ms2mol_evaluation.metfrag import SCRATCH_DIR_ENV
+from ms2mol_evaluation.metfrag_config import local_database_path
+from ms2mol_evaluation.scheduling import SCHEDULES, predict_costs
 from ms2mol_evaluation.spectrum import Spectrum
-from ms2mol_evaluation.utils import (
-    analyze_results,
-    convert_evaluation_results,
-    generate_full_results,
-)
+from ms2mol_evaluation.spectrum_store import SpectrumStore
+from ms2mol_evaluation.streaming import run_streaming_evaluation
+
+
+def retrieve_candidates(
+    spectra: T.List[Spectrum],
+    table: str,
+    database_type: str,
+) -> T.Tuple[T.List[T.Dict[str, T.Any]], np.ndarray]:
+    index = CandidateIndex.from_local_database(table, database_type)
+    counts = index.candidate_counts(spectra)
+    print(f"Candidates per spectrum in {table}:")
+    print(pd.Series(counts).describe().to_string())
+    return index.write_candidate_files(spectra, database_type=database_type), counts
 
 
 def main():
@@ -26,14 +40,58 @@ def main():
         default=-1,
         help="Number of CPUs to use (default: all available)",
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=8,
+        help="Number of spectra sent to MetFrag per job (default: 8)",
+    )
+    parser.add_argument(
+        "--database_type",
+        choices=["Postgres", "LocalCSV", "LocalPSV"],
+        default="Postgres",
+        help="Candidate database used by MetFrag (default: Postgres)",
+    )
+    parser.add_argument(
+        "--candidate_index",
+        action="store_true",
+        help="Retrieve candidates in memory and give MetFrag one small candidate file per spectrum (requires a local --database_type)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default="lotus_expanded_metfrag_ranks.checkpoint.csv",
+        help="Ranks of the evaluated spectra, a restart only runs the others (default: lotus_expanded_metfrag_ranks.checkpoint.csv)",
+    )
+    parser.add_argument(
+        "--report_every",
+        type=float,
+        default=60.0,
+        help="Seconds between running top-k estimates (default: 60)",
+    )
+    parser.add_argument(
+        "--schedule",
+        choices=SCHEDULES,
+        default="random",
+        help="Submit the spectra in a random order for unbiased running estimates, or with the longest predicted runtime first (default: random)",
+    )
+    parser.add_argument(
+        "--scratch_dir",
+        default=None,
+        help="Where the workers write the MetFrag configs and peak lists, e.g. a tmpfs such as /dev/shm (default: the system temporary directory)",
+    )
     args = parser.parse_args()
+    if args.scratch_dir is not None:
+        # read by the joblib workers, which inherit the environment
+        os.environ[SCRATCH_DIR_ENV] = args.scratch_dir
+    if args.candidate_index and args.database_type == "Postgres":
+        parser.error("--candidate_index requires a local --database_type.")
     _ = BaseDownloader(auto_extract=False).download(
         "https://github.com/ipb-halle/MetFragRelaunched/releases/download/v2.6.6/MetFragCommandLine-2.6.6.jar",
         "MetFragCommandLine-2.6.6.jar",
     )
 
     massspecgym = load_massspecgym()
-    spectra: T.List[Spectrum] = to_spectra(massspecgym)
+    store: SpectrumStore = to_spectra(massspecgym)
     lotus = pd.read_csv("data/lotus/230106_frozen_metadata.csv.gz", compression="gzip")
     lotus["structure_inchikey_1"] = lotus["structure_inchikey"].apply(
         lambda x: x.split("-")[0]
@@ -42,46 +100,64 @@ def main():
 
     inchikeys = set(lotus["structure_inchikey_1"].values)
 
-    spectra: T.List[Spectrum] = [
-        i for i in tqdm(spectra, leave=False) if i.get("inchikey") in inchikeys
-    ]
+    spectra: T.List[Spectrum] = store.take(
+        i
+        for i, inchikey in enumerate(tqdm(store.get("inchikey"), leave=False))
+        if inchikey in inchikeys
+    )
+
+    if args.database_type == "Postgres":
+        config_params = {"LocalDatabaseCompoundsTable": "lotus_expanded"}
+    else:
+        database_path = local_database_path("lotus_expanded", args.database_type)
+        if not database_path.exists():
+            raise FileNotFoundError(
+                f"{database_path} not found, build it with "
+                f"`create_lotus_expanded_db.py --database_type {args.database_type}`."
+            )
+        config_params = {
+            "MetFragDatabaseType": args.database_type,
+            "LocalDatabasePath": str(database_path),
+        }
 
-    results = Parallel(n_jobs=args.n_jobs)(
-        delayed(run_metfrag)(
-            spectrum, {"LocalDatabaseCompoundsTable": "lotus_expanded"}
+    candidate_counts = None
+    if args.candidate_index:
+        config_params, candidate_counts = retrieve_candidates(
+            spectra, "lotus_expanded", args.database_type
         )
-        for spectrum in tqdm(spectra, desc="Running MetFrag")
-    )
+    else:
+        config_params = [config_params] * len(spectra)
+
+    costs = None
+    costs_in_seconds = False
+    if args.schedule == "cost":
+        costs, cost_model = predict_costs(spectra, candidate_counts)
+        costs_in_seconds = cost_model.is_fitted
+        if cost_model.is_fitted:
+            print(f"Cost model fitted on {cost_model.n_samples} recorded runtimes")
+        else:
+            print("No recorded runtimes yet, ranking the spectra by their default cost")
 
     # we now check the top 1, 5, 10 and 20 results
     # we also want to check if there is a difference between H adduct or Na adduct
     # we also want to check if there is a difference between orbitrap and qtof
-    resulting_dataframes = [i[2] for i in results]
-
-    res = analyze_results(spectra, resulting_dataframes)
-    metrics: T.Dict[str, int] = res.pop("metrics")
-    for key, value in metrics.items():
-        if "_h" in key:
-            metrics[key] = metrics[key] / res["n_spectrum_h"]
-        elif "_na" in key:
-            metrics[key] = metrics[key] / res["n_spectrum_na"]
-        elif "_orbitrap" in key:
-            metrics[key] = metrics[key] / res["n_spectrum_orbitrap"]
-        elif "_qtof" in key:
-            metrics[key] = metrics[key] / res["n_spectrum_qtof"]
-        else:
-            metrics[key] = metrics[key] / res["n_total"]
-
-    out_df = pd.DataFrame.from_dict(
-        metrics,
-        orient="index",
-    ).T
+    ranks = run_streaming_evaluation(
+        spectra,
+        config_params,
+        checkpoint_path=args.checkpoint,
+        n_jobs=args.n_jobs,
+        batch_size=args.batch_size,
+        report_every=args.report_every,
+        costs=costs,
+        costs_in_seconds=costs_in_seconds,
+        summary_path="lotus_expanded_metfrag_results.running.csv",
+    )
 
-    convert_evaluation_results(out_df).to_csv(
+    evaluation_summary(ranks).to_csv(
         "lotus_expanded_metfrag_results.csv",
     )
 
-    df = generate_full_results(spectra, resulting_dataframes)
+    df = generate_full_results(ranks)
     df.to_csv("lotus_expanded_metfrag_scores.csv", index=False)
 
 
@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+
+from downloaders import BaseDownloader
+
+from ms2mol_evaluation.candidates import CandidateIndex
+from ms2mol_evaluation.isdb import download_isdb, filter_massspecgym_spectra, load_isdb
+from ms2mol_evaluation.lotus import load_lotus_for_metfrag, write_local_database
+from ms2mol_evaluation.massspecgym import load_massspecgym, to_spectra
+from ms2mol_evaluation.metfrag import SCRATCH_DIR_ENV
+from ms2mol_evaluation.metfrag_config import local_database_path
+from ms2mol_evaluation.spectrum_store import SpectrumStore
+from ms2mol_evaluation.sweep import (
+    dedupe_configs,
+    expand_grid,
+    run_sweep,
+    sweep_summary,
+    widest_ppm,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Evaluate a grid of MetFrag parameters on the LOTUS evaluation spectra."
+    )
+    parser.add_argument(
+        "grid",
+        help='JSON file with the values of every swept parameter, e.g. {"MaximumTreeDepth": [1, 2]}, or a list of parameter dicts',
+    )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=-1,
+        help="Number of CPUs to use (default: all available)",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=None,
+        help="Number of runs sent to MetFrag per job (default: the number of configurations)",
+    )
+    parser.add_argument(
+        "--database_type",
+        choices=["Postgres", "LocalCSV", "LocalPSV"],
+        default="Postgres",
+        help="Candidate database used by MetFrag (default: Postgres)",
+    )
+    parser.add_argument(
+        "--candidate_index",
+        action="store_true",
+        help="Retrieve the candidates of every spectrum once, for all configurations (requires a local --database_type)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default="lotus_metfrag_sweep.checkpoint.csv",
+        help="Ranks of the finished runs, a restart only runs the others (default: lotus_metfrag_sweep.checkpoint.csv)",
+    )
+    parser.add_argument(
+        "--report_every",
+        type=float,
+        default=60.0,
+        help="Seconds between running top-k estimates (default: 60)",
+    )
+    parser.add_argument(
+        "--scratch_dir",
+        default=None,
+        help="Where the workers write the MetFrag configs and peak lists, e.g. a tmpfs such as /dev/shm (default: the system temporary directory)",
+    )
+    args = parser.parse_args()
+    if args.scratch_dir is not None:
+        # read by the joblib workers, which inherit the environment
+        os.environ[SCRATCH_DIR_ENV] = args.scratch_dir
+    if args.candidate_index and args.database_type == "Postgres":
+        parser.error("--candidate_index requires a local --database_type.")
+
+    with open(args.grid) as f:
+        grid = expand_grid(json.load(f))
+    configs = dedupe_configs(grid)
+    print(f"{len(configs)} distinct configurations out of {len(grid)}:")
+    for name in configs:
+        print(f"  {name}")
+
+    _ = BaseDownloader(auto_extract=False).download(
+        "https://github.com/ipb-halle/MetFragRelaunched/releases/download/v2.6.6/MetFragCommandLine-2.6.6.jar",
+        "MetFragCommandLine-2.6.6.jar",
+    )
+
+    massspecgym = load_massspecgym()
+    store: SpectrumStore = to_spectra(massspecgym)
+    download_isdb()
+    isdb: SpectrumStore = load_isdb()
+    spectra = filter_massspecgym_spectra(store, isdb, hydrogen_adduct_only=False)
+
+    base_params = None
+    if args.database_type != "Postgres":
+        base_params = {"MetFragDatabaseType": args.database_type}
+        if not local_database_path("lotus", args.database_type).exists():
+            write_local_database(load_lotus_for_metfrag(), "lotus", args.database_type)
+
+    if args.candidate_index:
+        # MetFrag narrows the candidates of the widest window down for the other configurations
+        index = CandidateIndex.from_local_database("lotus", args.database_type)
+        base_params = index.write_candidate_files(
+            spectra, ppm=widest_ppm(configs), database_type=args.database_type
+        )
+    else:
+        base_params = [base_params] * len(spectra)
+
+    ranks = run_sweep(
+        spectra,
+        configs,
+        base_params,
+        checkpoint_path=args.checkpoint,
+        n_jobs=args.n_jobs,
+        batch_size=args.batch_size,
+        report_every=args.report_every,
+        summary_path="lotus_metfrag_sweep.running.csv",
+    )
+
+    summary = sweep_summary(ranks)
+    print(summary.to_string(float_format="{:.4f}".format))
+    summary.to_csv("lotus_metfrag_sweep.csv")
+    ranks.to_csv("lotus_metfrag_sweep_ranks.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import hashlib
+import typing as T
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ms2mol_evaluation.metfrag_config import (
+    ADDUCTS_TO_MASS,
+    LOCAL_DATABASE_SEPARATORS,
+    local_database_path,
+)
+from ms2mol_evaluation.spectrum import Spectrum
+
+
+def neutral_masses(
+    precursor_mzs: T.Sequence[float],
+    adducts: T.Sequence[str],
+) -> np.ndarray:
+    """
+    Convert precursor m/z values to the neutral monoisotopic masses MetFrag searches for.
+    """
+    unknown = set(adducts) - set(ADDUCTS_TO_MASS)
+    if unknown:
+        raise ValueError(
+            f"Invalid adduct type: {sorted(unknown)}. Must be one of {list(ADDUCTS_TO_MASS.keys())}."
+        )
+    adduct_masses = np.array([ADDUCTS_TO_MASS[adduct] for adduct in adducts])
+    return np.asarray(precursor_mzs, dtype=np.float64) - adduct_masses
+
+
+class CandidateIndex:
+    """
+    In-memory precursor mass index over a MetFrag formatted candidate table.
+
+    The candidates are sorted by monoisotopic mass once, so the candidates of a
+    spectrum are a contiguous slice found with two binary searches, the same
+    relative mass window MetFrag would query in Postgres.
+    """
+
+    def __init__(self, df: pd.DataFrame, table: str = "lotus"):
+        """
+        Args:
+            df (pd.DataFrame): DataFrame with the MetFrag columns, as returned by `load_lotus_for_metfrag`.
+            table (str): Name of the candidate table, used to name the candidate files.
+        """
+        self._table = table
+        self._df = df.sort_values("MonoisotopicMass", kind="stable").reset_index(
+            drop=True
+        )
+        self._masses = self._df["MonoisotopicMass"].to_numpy(dtype=np.float64)
+        # candidate files are only valid for this exact table
+        self._fingerprint = hashlib.sha256(self._masses.tobytes()).hexdigest()[:12]
+
+    @classmethod
+    def from_local_database(
+        cls,
+        table: str = "lotus",
+        database_type: str = "LocalCSV",
+    ) -> "CandidateIndex":
+        """
+        Build the index from a file written by `write_local_database`.
+        """
+        df = pd.read_csv(
+            local_database_path(table, database_type),
+            sep=LOCAL_DATABASE_SEPARATORS[database_type],
+        )
+        return cls(df, table=table)
+
+    def __len__(self) -> int:
+        return len(self._masses)
+
+    def windows(
+        self,
+        precursor_mzs: T.Sequence[float],
+        adducts: T.Sequence[str],
+        ppm: float = 10.0,
+    ) -> T.Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the [start, stop) row range of the candidates of every precursor.
+
+        Args:
+            precursor_mzs (Sequence[float]): Precursor m/z values.
+            adducts (Sequence[str]): Adduct of each precursor.
+            ppm (float): Relative mass deviation, as `DatabaseSearchRelativeMassDeviation`.
+        """
+        masses = neutral_masses(precursor_mzs, adducts)
+        deviation = masses * ppm * 1e-6
+        start = np.searchsorted(self._masses, masses - deviation, side="left")
+        stop = np.searchsorted(self._masses, masses + deviation, side="right")
+        return start, stop
+
+    def query(
+        self,
+        precursor_mz: float,
+        adduct: str,
+        ppm: float = 10.0,
+    ) -> pd.DataFrame:
+        """
+        Returns the candidate rows of a single precursor.
+        """
+        start, stop = self.windows([precursor_mz], [adduct], ppm)
+        return self._df.iloc[start[0] : stop[0]]
+
+    def candidate_counts(
+        self,
+        spectra: T.List[Spectrum],
+        ppm: float = 10.0,
+    ) -> np.ndarray:
+        """
+        Returns the number of candidates in the mass window of every spectrum.
+        """
+        start, stop = self.windows(
+            [s.get("precursor_mz") for s in spectra],
+            [s.get("adduct") for s in spectra],
+            ppm,
+        )
+        return stop - start
+
+    def write_candidate_files(
+        self,
+        spectra: T.List[Spectrum],
+        ppm: float = 10.0,
+        database_type: str = "LocalCSV",
+        directory: T.Union[str, Path] = "data/candidates",
+    ) -> T.List[T.Dict[str, T.Any]]:
+        """
+        Write the candidates of every spectrum as a small local MetFrag database.
+
+        Spectra with the same candidate window (e.g. the same compound measured at
+        several collision energies) share a single lookup and file. Files are named
+        after their row range, so they are reused across runs and the MetFrag
+        config hashes stay stable.
+
+        Args:
+            spectra (List[Spectrum]): Spectra to retrieve candidates for.
+            ppm (float): Relative mass deviation, as `DatabaseSearchRelativeMassDeviation`.
+            database_type (str): "LocalCSV" or "LocalPSV".
+            directory (str | Path): Where to write the candidate files.
+
+        Returns:
+            list: The `config_params` pointing MetFrag to the candidate file of each spectrum.
+        """
+        directory = Path(directory) / f"{self._table}_{self._fingerprint}"
+        directory.mkdir(parents=True, exist_ok=True)
+        extension = local_database_path(self._table, database_type).suffix
+
+        start, stop = self.windows(
+            [s.get("precursor_mz") for s in spectra],
+            [s.get("adduct") for s in spectra],
+            ppm,
+        )
+        config_params = []
+        paths = {}
+        for window in zip(start.tolist(), stop.tolist()):
+            if window not in paths:
+                path = directory / f"{window[0]}_{window[1]}{extension}"
+                if not path.exists():
+                    tmp_path = path.with_name(path.name + ".tmp")
+                    self._df.iloc[window[0] : window[1]].to_csv(
+                        tmp_path,
+                        sep=LOCAL_DATABASE_SEPARATORS[database_type],
+                        index=False,
+                    )
+                    tmp_path.replace(path)
+                paths[window] = path
+            config_params.append(
+                {
+                    "MetFragDatabaseType": database_type,
+                    "LocalDatabasePath": str(paths[window]),
+                }
+            )
+        return config_params
@@ -0,0 +1,274 @@
+import typing as T
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from ms2mol_evaluation.spectrum import Spectrum
+from ms2mol_evaluation.spectrum_store import SpectrumStore, get_metadata
+
+TOP_K = (1, 5, 10, 20)
+# the only MetFrag result columns the ranking needs
+RANKING_COLUMNS = ("InChIKey1", "Score")
+STRATA = (
+    "adduct",
+    "instrument_type",
+    "collision_energy",
+    "fold",
+    "simulation_challenge",
+)
+TIE_POLICIES = ("ordinal", "optimistic", "pessimistic", "expected")
+# short names of the strata values in the evaluation summaries
+CATEGORY_NAMES = {
+    "[M+H]+": "h",
+    "[M+Na]+": "na",
+    "Orbitrap": "orbitrap",
+    "QTOF": "qtof",
+}
+
+
+def true_candidate_rank(
+    result: pd.DataFrame,
+    inchikey: T.Optional[str],
+) -> T.Tuple[int, int, int, float]:
+    """
+    Locate the true molecule in the ranked MetFrag candidates of a spectrum.
+
+    Args:
+        result (pd.DataFrame): MetFrag candidates, best first, with the "InChIKey1" and "Score" columns.
+        inchikey (str, optional): InChIKey1 of the true molecule.
+
+    Returns:
+        tuple: Ordinal rank (position in the MetFrag output), best and worst rank
+            among the candidates with the same score, and the score. Ranks start
+            at 1 and are 0 if the true molecule is not a candidate.
+    """
+    if result.empty or "InChIKey1" not in result.columns:
+        return 0, 0, 0, np.nan
+    matches = np.flatnonzero(result["InChIKey1"].to_numpy() == inchikey)
+    if len(matches) == 0:
+        return 0, 0, 0, np.nan
+    position = matches[0]
+    scores = result["Score"].to_numpy(dtype=np.float64)
+    score = scores[position]
+    rank_min = int(np.count_nonzero(scores > score)) + 1
+    rank_max = int(np.count_nonzero(scores >= score))
+    return int(position) + 1, rank_min, rank_max, float(score)
+
+
+def spectrum_metadata(
+    spectra: T.Union[SpectrumStore, T.List[Spectrum]],
+    strata: T.Sequence[str] = STRATA,
+) -> pd.DataFrame:
+    """
+    Returns the identifier, InChIKey1, SMILES and strata of every spectrum.
+    """
+    table = {
+        "identifier": get_metadata(spectra, "identifier"),
+        "inchikey": get_metadata(spectra, "inchikey"),
+        "smiles": get_metadata(spectra, "smiles"),
+    }
+    for stratum in strata:
+        table[stratum] = get_metadata(spectra, stratum)
+    return pd.DataFrame(table)
+
+
+def rank_columns(
+    rows: T.Sequence[T.Tuple[int, int, int, int, float]],
+) -> T.Dict[str, np.ndarray]:
+    """
+    Columns of a rank table from the (n_candidates, *true_candidate_rank) of every spectrum.
+    """
+    n_candidates, ranks, ranks_min, ranks_max, scores = (
+        map(list, zip(*rows)) if len(rows) else ([], [], [], [], [])
+    )
+    return {
+        "n_candidates": np.array(n_candidates, dtype=np.int64),
+        "score": np.array(scores, dtype=np.float64),
+        "rank": np.array(ranks, dtype=np.int64),
+        "rank_min": np.array(ranks_min, dtype=np.int64),
+        "rank_max": np.array(ranks_max, dtype=np.int64),
+    }
+
+
+def rank_table(
+    spectra: T.Union[SpectrumStore, T.List[Spectrum]],
+    results: T.Iterable[pd.DataFrame],
+    strata: T.Sequence[str] = STRATA,
+) -> pd.DataFrame:
+    """
+    Extract the rank of the true molecule of every spectrum, once.
+
+    The table holds everything top-k accuracies are computed from, so they can
+    be aggregated for any k, strata or tie policy without reading the MetFrag
+    results again. The results are consumed in a single pass, so they can be
+    read lazily (e.g. with `iter_results(configs, RANKING_COLUMNS)`), with only
+    one of them in memory at a time.
+
+    Args:
+        spectra (SpectrumStore | List[Spectrum]): The evaluated spectra.
+        results (Iterable[pd.DataFrame]): MetFrag candidates of each spectrum, in the same order,
+            with at least the `RANKING_COLUMNS`.
+        strata (Sequence[str]): Spectrum metadata kept to stratify the accuracies.
+
+    Returns:
+        pd.DataFrame: One row per spectrum with its identifier, InChIKey1, SMILES,
+            strata, number of candidates, score and the "rank", "rank_min" and
+            "rank_max" of the true molecule (see `true_candidate_rank`).
+    """
+    metadata = spectrum_metadata(spectra, strata)
+    rows = [
+        (len(result), *true_candidate_rank(result, inchikey))
+        for inchikey, result in tqdm(
+            zip(metadata["inchikey"], results, strict=True),
+            desc="Ranking results",
+            total=len(metadata),
+            leave=False,
+        )
+    ]
+    return metadata.assign(**rank_columns(rows))
+
+
+def top_k_hits(
+    ranks: pd.DataFrame,
+    ks: T.Sequence[int] = TOP_K,
+    tie_policy: str = "ordinal",
+) -> pd.DataFrame:
+    """
+    Returns the top-k hit of every spectrum for every k, as columns "top_<k>".
+
+    Args:
+        ranks (pd.DataFrame): Table from `rank_table`.
+        ks (Sequence[int]): Values of k.
+        tie_policy (str): How candidates with the same score as the true molecule count:
+            "ordinal" keeps the MetFrag output order, "optimistic" ranks the true
+            molecule first among them, "pessimistic" last, and "expected" gives the
+            probability of a hit when they are ordered at random.
+    """
+    if tie_policy not in TIE_POLICIES:
+        raise ValueError(
+            f"Invalid tie policy: {tie_policy}. Must be one of {list(TIE_POLICIES)}."
+        )
+    k = np.asarray(ks, dtype=np.int64)[None, :]
+    rank = ranks["rank"].to_numpy()[:, None]
+    rank_min = ranks["rank_min"].to_numpy()[:, None]
+    rank_max = ranks["rank_max"].to_numpy()[:, None]
+    found = rank > 0
+    if tie_policy == "ordinal":
+        hits = found & (rank <= k)
+    elif tie_policy == "optimistic":
+        hits = found & (rank_min <= k)
+    elif tie_policy == "pessimistic":
+        hits = found & (rank_max <= k)
+    else:
+        hits = np.where(
+            found,
+            np.clip((k - rank_min + 1) / np.maximum(rank_max - rank_min + 1, 1), 0, 1),
+            0.0,
+        )
+    return pd.DataFrame(
+        hits.astype(np.float64),
+        columns=[f"top_{k}" for k in ks],
+        index=ranks.index,
+    )
+
+
+def top_k_accuracy(
+    ranks: pd.DataFrame,
+    ks: T.Sequence[int] = TOP_K,
+    by: T.Optional[T.Union[str, T.List[str]]] = None,
+    tie_policy: str = "ordinal",
+) -> pd.DataFrame:
+    """
+    Top-k accuracy overall or per stratum, in a single grouped aggregation.
+
+    Spectra without results, or whose true molecule is not a candidate, count
+    as misses.
+
+    Args:
+        ranks (pd.DataFrame): Table from `rank_table`.
+        ks (Sequence[int]): Values of k.
+        by (str | List[str], optional): Columns of `ranks` to group by, e.g. "adduct".
+        tie_policy (str): See `top_k_hits`.
+
+    Returns:
+        pd.DataFrame: Accuracy for each k, with the number of spectra in "n_spectra".
+    """
+    hits = top_k_hits(ranks, ks, tie_policy)
+    hits["n_spectra"] = 1
+    if by is None:
+        accuracy = hits.mean().to_frame("overall").T
+        accuracy["n_spectra"] = len(hits)
+        return accuracy
+    keys = [by] if isinstance(by, str) else list(by)
+    grouped = pd.concat([ranks[keys], hits], axis=1).groupby(keys, dropna=False)
+    accuracy = grouped.mean()
+    accuracy["n_spectra"] = grouped.size()
+    return accuracy
+
+
+def evaluation_summary(
+    ranks: pd.DataFrame,
+    ks: T.Sequence[int] = TOP_K,
+    strata: T.Sequence[str] = ("adduct", "instrument_type"),
+    tie_policy: str = "ordinal",
+) -> pd.DataFrame:
+    """
+    Top-k accuracy of every value of the strata, followed by the overall accuracy.
+
+    Returns:
+        pd.DataFrame: Indexed by "category", e.g. "h", "na", "orbitrap", "qtof" and "overall".
+    """
+    summaries = []
+    for stratum in strata:
+        accuracy = top_k_accuracy(ranks, ks, stratum, tie_policy)
+        accuracy.index = [
+            CATEGORY_NAMES.get(value, value) for value in accuracy.index.tolist()
+        ]
+        summaries.append(accuracy.sort_index())
+    summaries.append(top_k_accuracy(ranks, ks, tie_policy=tie_policy))
+    summary = pd.concat(summaries).drop(columns="n_spectra")
+    summary.index.name = "category"
+    return summary
+
+
+def compare_configs(
+    ranks: T.Mapping[str, pd.DataFrame],
+    ks: T.Sequence[int] = TOP_K,
+    by: T.Optional[T.Union[str, T.List[str]]] = None,
+    tie_policy: str = "ordinal",
+) -> pd.DataFrame:
+    """
+    Top-k accuracy of several MetFrag configurations side by side.
+
+    Args:
+        ranks (Mapping[str, pd.DataFrame]): Rank table of each configuration, by name.
+        ks (Sequence[int]): Values of k.
+        by (str | List[str], optional): Strata to group by within each configuration.
+        tie_policy (str): See `top_k_hits`.
+
+    Returns:
+        pd.DataFrame: Accuracies indexed by "config" (and the strata).
+    """
+    keys = [] if by is None else [by] if isinstance(by, str) else list(by)
+    combined = pd.concat(ranks, names=["config", None]).reset_index(level="config")
+    return top_k_accuracy(combined, ks, ["config", *keys], tie_policy)
+
+
+def generate_full_results(ranks: pd.DataFrame) -> pd.DataFrame:
+    """
+    Score and rank of the true molecule of the spectra it was found for.
+    """
+    found = ranks[ranks["rank"] > 0]
+    return pd.DataFrame(
+        {
+            "n_empty": len(ranks) - len(found),
+            "score": found["score"],
+            "top_n": found["rank"],
+            "inchikey": found["inchikey"],
+            "smiles": found["smiles"],
+            "adduct": found["adduct"],
+            "instrument_type": found["instrument_type"],
+            "identifier": found["identifier"],
+        }
+    ).reset_index(drop=True)
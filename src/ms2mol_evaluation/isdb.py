@@ -1,56 +1,58 @@
 import typing as T
+from pathlib import Path
 
-from cache_decorator import Cache
 from downloaders import BaseDownloader
-from matchms.filtering import default_filters
-from matchms.importing import load_from_mgf
 from tqdm import tqdm
 
+from ms2mol_evaluation.mgf import IndexedMGF
 from ms2mol_evaluation.spectrum import Spectrum
+from ms2mol_evaluation.spectrum_store import SpectrumStore, get_metadata
+
+ISDB_MGF_PATH = "data/isdb/isdb_lotus_pos_energySum.mgf"
 
 
 def download_isdb() -> None:
     downloader = BaseDownloader(auto_extract=False)
     _ = downloader.download(
         "https://zenodo.org/records/14887271/files/isdb_lotus_pos_energySum.mgf",
-        "data/isdb/isdb_lotus_pos_energySum.mgf",
+        ISDB_MGF_PATH,
     )
 
 
-@Cache()
-def load_isdb() -> T.List[Spectrum]:
-    """Load ISDB spectra from MGF file."""
-    spectra = []
-    for spectrum in tqdm(
-        load_from_mgf("data/isdb/isdb_lotus_pos_energySum.mgf"),
-        desc="Loading ISDB spectra",
-        leave=False,
-    ):
-        spectrum = default_filters(spectrum)
-        spectrum = Spectrum(
-            mz=spectrum.mz,
-            intensities=spectrum.intensities,
-            metadata=spectrum.metadata,
-        )
-        spectra.append(spectrum)
+def open_isdb(n_jobs: int = -1) -> IndexedMGF:
+    """
+    Open the ISDB MGF file for lazy iteration and lookups by compound name or precursor m/z.
+    """
+    return IndexedMGF(ISDB_MGF_PATH, n_jobs=n_jobs)
+
 
-    return spectra
+def load_isdb() -> SpectrumStore:
+    """Load ISDB spectra from MGF file, cached as a memory-mapped `SpectrumStore`."""
+    store_path = Path("cache/load_isdb/spectra")
+    if SpectrumStore.exists(store_path):
+        return SpectrumStore(store_path)
+
+    isdb = open_isdb()
+    spectra = tqdm(
+        isdb.iter_spectra(), total=len(isdb), desc="Loading ISDB spectra", leave=False
+    )
+    return SpectrumStore.write(spectra, store_path)
 
 
 def filter_massspecgym_spectra(
-    massspecgym_spectra: T.List[Spectrum],
-    isdb_spectra: T.List[Spectrum],
+    massspecgym_spectra: T.Union[SpectrumStore, T.List[Spectrum]],
+    isdb_spectra: T.Union[SpectrumStore, IndexedMGF, T.List[Spectrum]],
     hydrogen_adduct_only: bool = False,
 ) -> T.List[Spectrum]:
     """Filter MassSpecGym spectra to only include those present in ISDB."""
-    isdb_inchikeys = set(s.get("compound_name") for s in isdb_spectra)
-    filtered_spectra = [
-        s
-        for s in tqdm(
-            massspecgym_spectra, leave=False, desc="Filtering MassSpecGym spectra"
+    isdb_inchikeys = set(get_metadata(isdb_spectra, "compound_name"))
+    inchikeys = get_metadata(massspecgym_spectra, "inchikey")
+    adducts = get_metadata(massspecgym_spectra, "adduct")
+    return [
+        massspecgym_spectra[i]
+        for i in tqdm(
+            range(len(inchikeys)), leave=False, desc="Filtering MassSpecGym spectra"
         )
-        if s.get("inchikey") in isdb_inchikeys
+        if inchikeys[i] in isdb_inchikeys
+        and (not hydrogen_adduct_only or adducts[i] == "[M+H]+")
     ]
-    if hydrogen_adduct_only:
-        filtered_spectra = [s for s in filtered_spectra if s.get("adduct") == "[M+H]+"]
-    return filtered_spectra
@@ -0,0 +1,60 @@
+import java.io.BufferedReader;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.nio.charset.StandardCharsets;
+import java.util.jar.JarFile;
+
+/**
+ * Long-lived MetFrag worker.
+ *
+ * Usage: java -cp MetFragCommandLine.jar MetFragWorker.java MetFragCommandLine.jar
+ *
+ * Reads one MetFrag parameter file path per line from stdin and runs the
+ * command line entry point of the jar on it inside this JVM. Every job is
+ * answered with a single line on stdout, either "OK\t<path>" or
+ * "ERROR\t<path>\t<message>". MetFrag's own console output is discarded so
+ * that stdout only carries the protocol.
+ */
+public class MetFragWorker {
+    public static void main(String[] args) throws Exception {
+        PrintStream protocol = new PrintStream(
+            new FileOutputStream(FileDescriptor.out), true, StandardCharsets.UTF_8
+        );
+        System.setOut(new PrintStream(OutputStream.nullOutputStream()));
+
+        String mainClass;
+        try (JarFile jar = new JarFile(args[0])) {
+            mainClass = jar.getManifest().getMainAttributes().getValue("Main-Class");
+        }
+        Method entryPoint = Class.forName(mainClass).getMethod("main", String[].class);
+
+        BufferedReader reader = new BufferedReader(
+            new InputStreamReader(System.in, StandardCharsets.UTF_8)
+        );
+        protocol.println("READY");
+        String line;
+        while ((line = reader.readLine()) != null) {
+            String path = line.trim();
+            if (path.isEmpty()) {
+                continue;
+            }
+            try {
+                entryPoint.invoke(null, (Object) new String[] {path});
+                protocol.println("OK\t" + path);
+            } catch (InvocationTargetException e) {
+                protocol.println("ERROR\t" + path + "\t" + describe(e.getCause()));
+            } catch (Throwable e) {
+                protocol.println("ERROR\t" + path + "\t" + describe(e));
+            }
+        }
+    }
+
+    private static String describe(Throwable error) {
+        return String.valueOf(error).replace('\n', ' ').replace('\t', ' ');
+    }
+}
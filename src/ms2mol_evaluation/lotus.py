@@ -1,13 +1,22 @@
+import os
+import typing as T
+from pathlib import Path
+
 import pandas as pd
 from downloaders import BaseDownloader
 
+from ms2mol_evaluation.metfrag_config import (
+    LOCAL_DATABASE_SEPARATORS,
+    local_database_path,
+)
+
 
-def create_lotus_table_query():
-    query = """
-DROP TABLE IF EXISTS lotus;
-DROP INDEX IF EXISTS idx_lotus_mass;
-CREATE TABLE IF NOT EXISTS lotus (
-    id SERIAL PRIMARY KEY,
+def create_lotus_table_query(table_name: str = "lotus", unlogged: bool = False):
+    query = f"""
+DROP TABLE IF EXISTS {table_name};
+DROP INDEX IF EXISTS idx_{table_name}_mass;
+CREATE {"UNLOGGED " if unlogged else ""}TABLE IF NOT EXISTS {table_name} (
+    id SERIAL,
     identifier TEXT NOT NULL,
     inchi TEXT NOT NULL,
     monoisotopic_mass FLOAT NOT NULL,
@@ -75,8 +84,50 @@ INSERT INTO lotus (
     return insert_query
 
 
-def generate_index_query():
-    index_query = """
-CREATE INDEX IF NOT EXISTS idx_lotus_mass ON lotus (monoisotopic_mass);
+def generate_index_query(table_name: str = "lotus"):
+    index_query = f"""
+ALTER TABLE {table_name} ADD PRIMARY KEY (id);
+CREATE INDEX IF NOT EXISTS idx_{table_name}_mass ON {table_name} (monoisotopic_mass);
 """
     return index_query
+
+
+def write_local_database(
+    df: T.Union[pd.DataFrame, T.Iterable[pd.DataFrame]],
+    table: str = "lotus",
+    database_type: str = "LocalCSV",
+    path: T.Optional[T.Union[str, Path]] = None,
+) -> Path:
+    """
+    Writes a MetFrag formatted DataFrame as a file-backed candidate database.
+
+    The columns of `load_lotus_for_metfrag` (and of the lotus_expanded build) are
+    the default column names of MetFrag's LocalCSV/LocalPSV databases, so the
+    DataFrame is written as-is. A stream of DataFrames is appended batch by
+    batch, with a single header. The file is renamed into place only once fully
+    written, so a running evaluation never reads a partial database.
+
+    Args:
+        df (pd.DataFrame | Iterable[pd.DataFrame]): DataFrame with the MetFrag columns,
+            or a stream of batches of it.
+        table (str): Name of the candidate table, used for the default path.
+        database_type (str): "LocalCSV" or "LocalPSV".
+        path (str | Path, optional): Output file. Defaults to `local_database_path(table, database_type)`.
+
+    Returns:
+        Path: The written database file.
+    """
+    path = Path(path) if path is not None else local_database_path(table, database_type)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    batches = [df] if isinstance(df, pd.DataFrame) else df
+    with open(tmp_path, "w") as f:
+        for i, batch in enumerate(batches):
+            batch.to_csv(
+                f,
+                sep=LOCAL_DATABASE_SEPARATORS[database_type],
+                header=i == 0,
+                index=False,
+            )
+    os.replace(tmp_path, path)
+    return path
@@ -1,12 +1,36 @@
+import typing as T
+
 TABLE_NAME = "lotus_expanded"
+INDEX_LAYOUTS = ("mass", "covering")
+# masses above the last bound all go to the last partition
+MAX_PARTITIONED_MASS = 2000.0
+
+
+def partition_bounds(width: float) -> T.List[float]:
+    """
+    Returns the inner bounds of a mass-range partitioned layout, `width` Da apart.
+    """
+    return [width * i for i in range(1, int(MAX_PARTITIONED_MASS // width) + 1)]
 
 
-def create_table_query():
+def create_table_query(
+    table_name: str = TABLE_NAME,
+    unlogged: bool = False,
+    partition_width: T.Optional[float] = None,
+):
+    """
+    Args:
+        table_name (str): Name of the table.
+        unlogged (bool): Whether to create the table (or its partitions) unlogged.
+        partition_width (float, optional): Partition the table by ranges of this
+            many Da of monoisotopic mass, not partitioned by default.
+    """
+    unlogged = "UNLOGGED " if unlogged else ""
     query = f"""
-DROP TABLE IF EXISTS {TABLE_NAME};
-DROP INDEX IF EXISTS idx_{TABLE_NAME}_mass;
-CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-    id SERIAL PRIMARY KEY,
+DROP TABLE IF EXISTS {table_name};
+DROP INDEX IF EXISTS idx_{table_name}_mass;
+CREATE {"" if partition_width else unlogged}TABLE IF NOT EXISTS {table_name} (
+    id SERIAL,
     identifier TEXT NOT NULL,
     inchi TEXT NOT NULL,
     monoisotopic_mass FLOAT NOT NULL,
@@ -16,8 +40,12 @@ CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
     smiles TEXT NOT NULL,
     name CHAR(27) NOT NULL,
     inchikey_3 CHAR(1) NOT NULL
-);
+){" PARTITION BY RANGE (monoisotopic_mass)" if partition_width else ""};
 """
+    if partition_width:
+        bounds = ["MINVALUE", *map(str, partition_bounds(partition_width)), "MAXVALUE"]
+        for i, (low, high) in enumerate(zip(bounds[:-1], bounds[1:])):
+            query += f"CREATE {unlogged}TABLE {table_name}_p{i:03d} PARTITION OF {table_name} FOR VALUES FROM ({low}) TO ({high});\n"
     return query
 
 
@@ -31,8 +59,36 @@ INSERT INTO {TABLE_NAME} (
     return insert_query
 
 
-def create_index_query():
+def create_index_query(
+    table_name: str = TABLE_NAME,
+    layout: str = "mass",
+    partition_width: T.Optional[float] = None,
+):
+    """
+    Args:
+        table_name (str): Name of the table.
+        layout (str): "mass" for a plain index on the monoisotopic mass, or
+            "covering" to also answer MetFrag's mass-window query (which only
+            selects the identifier) from the index alone, and index the
+            identifiers the candidate rows are then fetched by.
+        partition_width (float, optional): Partition width of the table, the
+            partition key has to be part of the primary key.
+    """
+    if layout not in INDEX_LAYOUTS:
+        raise ValueError(
+            f"Invalid index layout: {layout}. Must be one of {list(INDEX_LAYOUTS)}."
+        )
+    primary_key = "id, monoisotopic_mass" if partition_width else "id"
     index_query = f"""
-CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_mass ON {TABLE_NAME} (monoisotopic_mass);
+ALTER TABLE {table_name} ADD PRIMARY KEY ({primary_key});
+"""
+    if layout == "mass":
+        index_query += f"""
+CREATE INDEX IF NOT EXISTS idx_{table_name}_mass ON {table_name} (monoisotopic_mass);
+"""
+    else:
+        index_query += f"""
+CREATE INDEX IF NOT EXISTS idx_{table_name}_mass ON {table_name} (monoisotopic_mass) INCLUDE (identifier);
+CREATE INDEX IF NOT EXISTS idx_{table_name}_identifier ON {table_name} (identifier);
 """
     return index_query
@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import typing as T
+from pathlib import Path
+
+import pandas as pd
+
+MANIFEST_PATH = Path("data/metfrag_cache/manifest.sqlite")
+# "done" runs have candidates and are reused, "empty" and "failed" ones are run again
+STATUSES = ("done", "empty", "failed")
+
+
+class ManifestEntry(T.NamedTuple):
+    spectrum_hash: str
+    config_hash: str
+    status: str
+    n_rows: T.Optional[int]
+    runtime: T.Optional[float]
+    output: str
+
+
+class CompletionManifest:
+    """
+    SQLite index of the MetFrag runs in the cache, keyed by (spectrum_hash, config_hash).
+
+    Deciding whether a spectrum has to be run is a primary key lookup, instead
+    of opening its results CSV. The database is in WAL mode, so the joblib
+    workers can record their runs concurrently. It only describes the cache, if
+    the cache directories are deleted (other than by `compact_results`), the
+    manifest has to be deleted too.
+    """
+
+    def __init__(self, path: T.Union[str, Path] = MANIFEST_PATH):
+        self._path = Path(path)
+        self._conn: T.Optional[sqlite3.Connection] = None
+        self._pid: T.Optional[int] = None
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def _connection(self) -> sqlite3.Connection:
+        # a connection must not be shared with forked processes
+        if self._conn is None or self._pid != os.getpid():
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self._path, timeout=60, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+CREATE TABLE IF NOT EXISTS runs (
+    spectrum_hash TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    n_rows INTEGER,
+    runtime REAL,
+    output TEXT NOT NULL,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (spectrum_hash, config_hash)
+) WITHOUT ROWID
+"""
+            )
+            self._pid = os.getpid()
+        return self._conn
+
+    def lookup(self, spectrum_hash: str, config_hash: str) -> T.Optional[ManifestEntry]:
+        """
+        Returns the recorded run of a spectrum and config, None if there is none.
+        """
+        row = (
+            self._connection()
+            .execute(
+                "SELECT spectrum_hash, config_hash, status, n_rows, runtime, output FROM runs WHERE spectrum_hash = ? AND config_hash = ?",
+                (spectrum_hash, config_hash),
+            )
+            .fetchone()
+        )
+        return None if row is None else ManifestEntry(*row)
+
+    def is_done(self, spectrum_hash: str, config_hash: str) -> bool:
+        entry = self.lookup(spectrum_hash, config_hash)
+        return entry is not None and entry.status == "done"
+
+    def record(
+        self,
+        spectrum_hash: str,
+        config_hash: str,
+        status: str,
+        n_rows: T.Optional[int],
+        runtime: T.Optional[float],
+        output: T.Union[str, Path],
+    ) -> None:
+        """
+        Record (or replace) the run of a spectrum and config.
+
+        Args:
+            spectrum_hash (str): Hash of the spectrum.
+            config_hash (str): Hash of the MetFrag config.
+            status (str): One of `STATUSES`.
+            n_rows (int, optional): Number of candidates MetFrag wrote.
+            runtime (float, optional): Seconds MetFrag ran, None if unknown.
+            output (str | Path): The results CSV.
+        """
+        if status not in STATUSES:
+            raise ValueError(
+                f"Invalid status: {status}. Must be one of {list(STATUSES)}."
+            )
+        self._connection().execute(
+            "INSERT OR REPLACE INTO runs (spectrum_hash, config_hash, status, n_rows, runtime, output) VALUES (?, ?, ?, ?, ?, ?)",
+            (spectrum_hash, config_hash, status, n_rows, runtime, str(output)),
+        )
+
+    def set_output(
+        self,
+        spectrum_hash: str,
+        config_hash: str,
+        output: T.Union[str, Path],
+    ) -> None:
+        """
+        Point a recorded run to where its results moved, e.g. a compacted Parquet file.
+        """
+        self._connection().execute(
+            "UPDATE runs SET output = ?, updated_at = CURRENT_TIMESTAMP WHERE spectrum_hash = ? AND config_hash = ?",
+            (str(output), spectrum_hash, config_hash),
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Returns every recorded run, e.g. to look at the MetFrag runtimes.
+        """
+        return pd.read_sql_query("SELECT * FROM runs", self._connection())
+
+    def close(self) -> None:
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+
+_MANIFESTS: T.Dict[Path, CompletionManifest] = {}
+
+
+def get_manifest(path: T.Union[str, Path] = MANIFEST_PATH) -> CompletionManifest:
+    """
+    Returns the manifest at a path, opened once per process.
+    """
+    path = Path(path)
+    if path not in _MANIFESTS:
+        _MANIFESTS[path] = CompletionManifest(path)
+    return _MANIFESTS[path]
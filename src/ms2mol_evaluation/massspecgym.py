@@ -1,14 +1,19 @@
 import typing as T
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from cache_decorator import Cache
+from dict_hash import sha256
 from huggingface_hub import hf_hub_download
 from matchms.filtering import default_filters
 from matchms.logging_functions import set_matchms_logger_level
 from pandarallel import pandarallel
 
 from ms2mol_evaluation.spectrum import Spectrum
+from ms2mol_evaluation.spectrum_store import SpectrumStore
 
 set_matchms_logger_level("ERROR")
 # Initialize pandarallel (add progress bar if you want)
@@ -19,6 +24,31 @@ def parse_spec_array(arr: str) -> np.ndarray:
     return np.array(list(map(float, arr.split(","))))
 
 
+def parse_spec_arrays(arrs: pd.Series) -> T.Tuple[np.ndarray, np.ndarray]:
+    """
+    Parse a whole column of comma separated peak strings at once.
+
+    Args:
+        arrs (pd.Series): Column of strings such as "91.05,105.07".
+
+    Returns:
+        tuple: The flat float64 values of all rows and the row offsets into them,
+            row i spans `values[offsets[i] : offsets[i + 1]]`.
+    """
+    split = pc.split_pattern(
+        pa.array(arrs.to_numpy(), type=pa.large_string()), pattern=","
+    )
+    values = pc.utf8_trim_whitespace(split.flatten()).cast(pa.float64())
+    return values.to_numpy(), split.offsets.to_numpy()
+
+
+def split_spec_arrays(values: np.ndarray, offsets: np.ndarray) -> T.List[np.ndarray]:
+    """
+    Returns one array per row, as views into the flat `values` buffer.
+    """
+    return [values[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
 def hugging_face_download(file_name: str) -> str:
     """
     Download a file from the Hugging Face Hub and return its location on disk.
@@ -43,14 +73,15 @@ def load_massspecgym(fold: T.Optional[str] = None) -> pd.DataFrame:
     """
     df = pd.read_csv(hugging_face_download("MassSpecGym.tsv"), sep="\t")
     df = df.set_index("identifier")
-    df["mzs"] = df["mzs"].apply(parse_spec_array)
-    df["intensities"] = df["intensities"].apply(parse_spec_array)
     if fold is not None:
-        df = df[df["fold"] == fold]
-
-    df["spectrum"] = df.apply(
-        lambda row: np.array([row["mzs"], row["intensities"]]), axis=1
-    )
+        df = df[df["fold"] == fold].copy()
+
+    # the peaks of each row are views into one flat buffer per column
+    for column in ("mzs", "intensities"):
+        values, offsets = parse_spec_arrays(df[column])
+        df[column] = pd.Series(
+            split_spec_arrays(values, offsets), index=df.index, dtype=object
+        )
     return df
 
 
@@ -78,18 +109,19 @@ def to_spectrum(row: pd.Series) -> Spectrum:
     )
 
 
-@Cache(
-    cache_path="cache/{function_name}/{_hash}/spectra.pkl",
-    use_approximated_hash=True,
-)
-def to_spectra(df: pd.DataFrame) -> T.List[Spectrum]:
+def to_spectra(df: pd.DataFrame) -> SpectrumStore:
+    """
+    Convert a MassSpecGym DataFrame to filtered spectra.
+
+    The spectra are cached as a memory-mapped `SpectrumStore`, keyed on the
+    DataFrame content, so later calls open the store instead of rebuilding it.
+    """
+    store_path = Path("cache/to_spectra") / sha256({"df": df}, use_approximation=True)
+    if SpectrumStore.exists(store_path):
+        return SpectrumStore(store_path)
+
     # Apply to_spectrum + default_filters in parallel
     spectra = df.parallel_apply(
         lambda row: default_filters(to_spectrum(row)), axis=1
     ).tolist()
-
-    spectra = [
-        Spectrum(mz=s.mz, intensities=s.intensities, metadata=s.metadata)
-        for s in spectra
-    ]
-    return spectra
+    return SpectrumStore.write(spectra, store_path)
@@ -1,82 +1,261 @@
-import subprocess
+import atexit
+import os
+import shutil
+import tempfile
+import time
 import typing as T
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from cache_decorator import Cache
 
+from ms2mol_evaluation.manifest import CompletionManifest, get_manifest
 from ms2mol_evaluation.metfrag_config import MetFragConfig
-from ms2mol_evaluation.spectrum import Spectrum
+from ms2mol_evaluation.metfrag_worker import run_metfrag_process
+from ms2mol_evaluation.results_dataset import (
+    KEY_COLUMNS,
+    POSITION_COLUMN,
+    read_compacted_results,
+)
+from ms2mol_evaluation.spectrum import Spectrum, hash_spectra
 
+CACHE_DIR = Path("data/metfrag_cache")
+SCRATCH_DIR_ENV = "METFRAG_SCRATCH_DIR"
 
-def write_metfrag_config(config: "MetFragConfig") -> str:
+_SCRATCH_DIR: T.Optional[Path] = None
+_SCRATCH_PID: T.Optional[int] = None
+
+
+def get_scratch_dir() -> Path:
+    """
+    Returns the scratch directory of the current process, creating it if needed.
+
+    The parameter files and peak lists MetFrag reads only live there, so
+    concurrent workers never share them and only the results reach the cache.
+    It is created in `$METFRAG_SCRATCH_DIR` (e.g. a tmpfs such as /dev/shm), or
+    in the system temporary directory, and removed when the process exits.
     """
-    Run MetFrag on a given spectrum with the provided configuration.
+    global _SCRATCH_DIR, _SCRATCH_PID
+    if _SCRATCH_DIR is None or _SCRATCH_PID != os.getpid():
+        base = os.getenv(SCRATCH_DIR_ENV) or None
+        if base is not None:
+            Path(base).mkdir(parents=True, exist_ok=True)
+        _SCRATCH_DIR = Path(tempfile.mkdtemp(prefix="metfrag-", dir=base))
+        _SCRATCH_PID = os.getpid()
+        atexit.register(shutil.rmtree, _SCRATCH_DIR, ignore_errors=True)
+    return _SCRATCH_DIR
+
+
+def write_metfrag_config(
+    config: "MetFragConfig",
+    directory: T.Optional[T.Union[str, Path]] = None,
+) -> str:
+    """
+    Write the MetFrag parameter file of a config, named after its cache directory.
 
     Args:
-        spectrum (Spectrum): The spectrum to analyze.
         config (MetFragConfig): Configuration for MetFrag analysis.
-    """
+        directory (str | Path, optional): Defaults to the scratch directory of the process.
 
-    config_file_name = config.consistent_hash(use_approximation=False) + ".cgf"
+    Returns:
+        str: The path of the parameter file.
+    """
+    directory = get_scratch_dir() if directory is None else Path(directory)
+    config_file_name = str(directory / f"{Path(config.get_results_path()).name}.cgf")
     with open(config_file_name, "w") as config_file:
         config_file.write(config.to_config_string())
 
     return config_file_name
 
 
+def write_peak_list(spectrum: Spectrum, peak_list_file: T.Union[str, Path]) -> None:
+    """
+    Write the tab separated m/z and intensities MetFrag reads, with the shortest repr of every float.
+    """
+    peaks = spectrum.peaks
+    lines = np.char.add(
+        np.char.add(peaks.mz.astype(str), "\t"), peaks.intensities.astype(str)
+    )
+    with open(peak_list_file, "w") as f:
+        f.write("".join(line + "\n" for line in lines.tolist()))
+
+
 def get_spectrum_hash(spectrum: Spectrum, use_approximation=False) -> str:
     return spectrum.consistent_hash(use_approximation=use_approximation)
 
 
-def create_metfrag_config(
+def cached_metfrag_config(
     spectrum: Spectrum,
     config_params: T.Optional[T.Dict[str, T.Any]] = None,
-) -> T.Tuple[str, "MetFragConfig"]:
-    # Step 1: Compute spectrum hash
-    spectrum_hash = get_spectrum_hash(spectrum, use_approximation=False)
-
-    # Step 2: Create a temporary config to compute config hash
-    temp_peak_list_file = Path(
-        f"cache/peak_list_{spectrum_hash}.txt"
-    )  # dummy path for hash computation
-    temp_config = MetFragConfig(
-        spectrum.get("precursor_mz"),
-        spectrum.get("adduct"),
-        peak_list_file=temp_peak_list_file,
-        results_path="cache",  # dummy path
-        results_file="results",
-        config_params=config_params,
-    )
-    config_hash = temp_config.consistent_hash(use_approximation=False)
-
-    # Step 3: Combine hashes for directory
-    combined_dir = Path(f"data/metfrag_cache/{spectrum_hash}_{config_hash}")
-    combined_dir.mkdir(parents=True, exist_ok=True)
-    peak_list_file = combined_dir / "peak_list.txt"
-
-    # Step 4: Write peak list to the new directory
-    pd.DataFrame(spectrum.peaks.to_numpy).to_csv(
-        str(peak_list_file),
-        sep="\t",
-        header=False,
-        index=False,
-    )
+    spectrum_hash: T.Optional[str] = None,
+) -> T.Tuple[str, str, "MetFragConfig"]:
+    """
+    Returns the config of a spectrum with its results in the cache, without writing anything.
+
+    The config reads its peak list from the scratch directory of the process.
+
+    Args:
+        spectrum (Spectrum): The spectrum to analyze.
+        config_params (dict, optional): Additional configuration parameters for MetFrag.
+        spectrum_hash (str, optional): The hash of the spectrum, if already known
+            (e.g. from `hash_spectra`).
 
-    # Step 5: Create the final config with correct paths
+    Returns:
+        tuple: The spectrum hash and config hash the run is cached under, and the config.
+    """
+    if spectrum_hash is None:
+        spectrum_hash = get_spectrum_hash(spectrum, use_approximation=False)
     config = MetFragConfig(
         spectrum.get("precursor_mz"),
         spectrum.get("adduct"),
-        peak_list_file=peak_list_file,
-        results_path=combined_dir,
+        peak_list_file=CACHE_DIR / "peak_list.txt",
+        results_path=CACHE_DIR,
         results_file="results",
         config_params=config_params,
     )
+    # the config hash does not depend on the paths, which are set from it
+    config_hash = config.consistent_hash(use_approximation=False)
+    key = f"{spectrum_hash}_{config_hash}"
+    # the peak list is shared by all configs of the spectrum
+    config.relocate(get_scratch_dir() / f"{spectrum_hash}.txt", CACHE_DIR / key)
+    return spectrum_hash, config_hash, config
+
 
+def create_metfrag_config(
+    spectrum: Spectrum,
+    config_params: T.Optional[T.Dict[str, T.Any]] = None,
+) -> T.Tuple[str, "MetFragConfig"]:
+    _, _, config = cached_metfrag_config(spectrum, config_params)
+    Path(config.get_results_path()).mkdir(parents=True, exist_ok=True)
+    write_peak_list(spectrum, config.get_peak_list_file())
     config_file = write_metfrag_config(config)
     return config_file, config
 
 
+def get_results_csv(config: "MetFragConfig") -> Path:
+    """
+    Returns the path of the CSV file MetFrag writes the candidates of a config to.
+    """
+    return Path(config.get_results_path()) / f"{config.get_results_file()}.csv"
+
+
+def cache_key(config: "MetFragConfig") -> T.Tuple[str, str]:
+    """
+    Returns the spectrum hash and config hash of a config in the cache.
+    """
+    spectrum_hash, _, config_hash = Path(config.get_results_path()).name.partition("_")
+    return spectrum_hash, config_hash
+
+
+def count_results(config: "MetFragConfig") -> T.Optional[int]:
+    """
+    Returns the number of candidates MetFrag wrote for a config, None if it wrote no results.
+    """
+    try:
+        return len(pd.read_csv(get_results_csv(config), usecols=[0]))
+    except FileNotFoundError:
+        return None
+    except pd.errors.EmptyDataError:
+        return 0
+
+
+def has_cached_results(config: "MetFragConfig") -> bool:
+    return bool(count_results(config))
+
+
+class PreparedRun(T.NamedTuple):
+    config_file: str
+    config: "MetFragConfig"
+    spectrum_hash: str
+    config_hash: str
+    cached: bool
+
+
+def prepare_metfrag_run(
+    spectrum: Spectrum,
+    config_params: T.Optional[T.Dict[str, T.Any]] = None,
+    manifest: T.Optional[CompletionManifest] = None,
+    spectrum_hash: T.Optional[str] = None,
+) -> PreparedRun:
+    """
+    Look up the run of a spectrum in the manifest, and write its inputs if it has to run.
+
+    Runs the manifest records as done are returned without touching the cache
+    directory. Results cached before the manifest existed are found on disk
+    once and recorded, so later lookups are O(1) too.
+
+    Args:
+        spectrum (Spectrum): The spectrum to analyze.
+        config_params (dict, optional): Additional configuration parameters for MetFrag.
+        manifest (CompletionManifest, optional): Defaults to the manifest of the cache.
+        spectrum_hash (str, optional): The hash of the spectrum, if already known.
+
+    Returns:
+        PreparedRun: The config file (only written if not cached), config, hashes,
+            and whether the results are cached.
+    """
+    manifest = manifest or get_manifest()
+    spectrum_hash, config_hash, config = cached_metfrag_config(
+        spectrum, config_params, spectrum_hash
+    )
+    config_file = str(get_scratch_dir() / f"{spectrum_hash}_{config_hash}.cgf")
+
+    if manifest.is_done(spectrum_hash, config_hash):
+        return PreparedRun(config_file, config, spectrum_hash, config_hash, True)
+    n_rows = count_results(config)
+    if n_rows:
+        manifest.record(
+            spectrum_hash, config_hash, "done", n_rows, None, get_results_csv(config)
+        )
+        return PreparedRun(config_file, config, spectrum_hash, config_hash, True)
+
+    Path(config.get_results_path()).mkdir(parents=True, exist_ok=True)
+    if not config.get_peak_list_file().exists():
+        write_peak_list(spectrum, config.get_peak_list_file())
+    write_metfrag_config(config)
+    return PreparedRun(config_file, config, spectrum_hash, config_hash, False)
+
+
+def execute_metfrag_run(
+    run: PreparedRun,
+    manifest: T.Optional[CompletionManifest] = None,
+) -> None:
+    """
+    Run MetFrag on a prepared run and record its outcome in the manifest.
+    """
+    manifest = manifest or get_manifest()
+    results_csv = get_results_csv(run.config)
+    start = time.perf_counter()
+    try:
+        run_metfrag_process(run.config_file)
+    except Exception:
+        manifest.record(
+            run.spectrum_hash,
+            run.config_hash,
+            "failed",
+            None,
+            time.perf_counter() - start,
+            results_csv,
+        )
+        raise
+    runtime = time.perf_counter() - start
+    n_rows = count_results(run.config)
+    manifest.record(
+        run.spectrum_hash,
+        run.config_hash,
+        "done" if n_rows else "empty" if n_rows == 0 else "failed",
+        n_rows,
+        runtime,
+        results_csv,
+    )
+
+
+def remove_inputs(run: PreparedRun) -> None:
+    Path(run.config_file).unlink(missing_ok=True)
+    run.config.get_peak_list_file().unlink(missing_ok=True)
+
+
 def run_metfrag(
     spectrum: Spectrum,
     config_params: T.Optional[T.Dict[str, T.Any]] = None,
@@ -91,28 +270,156 @@ def run_metfrag(
     Returns:
         tuple: A tuple containing the path to the MetFrag configuration file, the MetFragConfig object, and the results DataFrame.
     """
-    config_file, config = create_metfrag_config(spectrum, config_params)
+    run = prepare_metfrag_run(spectrum, config_params)
+    if not run.cached:
+        try:
+            execute_metfrag_run(run)
+        finally:
+            # once the process is done, we can delete its inputs
+            remove_inputs(run)
+    return run.config_file, run.config, read_results(run.config)
+
+
+def cache_metfrag_batch(
+    spectra: T.List[Spectrum],
+    config_params: T.Optional[
+        T.Union[T.Dict[str, T.Any], T.List[T.Dict[str, T.Any]]]
+    ] = None,
+) -> T.List[T.Tuple[str, "MetFragConfig"]]:
+    """
+    Run MetFrag on a batch of spectra, through a single MetFrag process when possible.
+
+    The spectra whose results the completion manifest records are skipped
+    without writing or reading any file. The configs and peak lists of the
+    others are written to the scratch directory of the process first and then
+    fed to the resident JVM of the process one after the other. If that worker
+    is unavailable (Java older than 11, `METFRAG_PERSISTENT_WORKER=0`, or
+    MetFrag ending the JVM after every job), each spectrum gets its own
+    `java -jar` call instead, so larger batches no longer save JVM startups;
+    `metfrag_mode` tells which mode the process is in.
+    Every spectrum still gets its own results in
+    `data/metfrag_cache/{spectrum_hash}_{config_hash}`, so cached results are
+    shared with `run_metfrag`. The results are left on disk, see `iter_results`.
 
-    # Determine expected results CSV path
-    results_csv = Path(config.get_results_path()) / f"{config.get_results_file()}.csv"
-    if results_csv.exists() and not pd.read_csv(results_csv).empty:
-        # Results already exist, skip running MetFrag
-        Path(config_file).unlink(missing_ok=True)
-        return config_file, config, pd.read_csv(results_csv)
+    Args:
+        spectra (List[Spectrum]): The spectra to analyze.
+        config_params (dict | list, optional): Additional configuration parameters for MetFrag,
+            either shared by the whole batch or one dict per spectrum.
 
-    command = [
-        "java",
-        "-jar",
-        "MetFragCommandLine-2.6.6.jar",
-        config_file,
+    Returns:
+        list: The config file name and MetFragConfig of each spectrum, in the input order.
+    """
+    if not isinstance(config_params, list):
+        config_params = [config_params] * len(spectra)
+    prepared = [
+        prepare_metfrag_run(spectrum, params, spectrum_hash=spectrum_hash)
+        for spectrum, params, spectrum_hash in zip(
+            spectra, config_params, hash_spectra(spectra), strict=True
+        )
     ]
 
-    subprocess.run(
-        command,
-        check=True,
-        stdout=subprocess.DEVNULL,
+    # identical spectra share the same config file, run each of them only once
+    pending = {run.config_file: run for run in prepared if not run.cached}
+    try:
+        for run in pending.values():
+            execute_metfrag_run(run)
+    finally:
+        for run in pending.values():
+            remove_inputs(run)
+    return [(run.config_file, run.config) for run in prepared]
+
+
+def run_metfrag_batch(
+    spectra: T.List[Spectrum],
+    config_params: T.Optional[
+        T.Union[T.Dict[str, T.Any], T.List[T.Dict[str, T.Any]]]
+    ] = None,
+) -> T.List[T.Tuple[str, "MetFragConfig", pd.DataFrame]]:
+    """
+    Same as `cache_metfrag_batch`, and read the results.
+
+    The spectra share one JVM only while the persistent worker is up, see `metfrag_mode`.
+
+    Returns:
+        list: One `run_metfrag`-like tuple per spectrum, in the input order.
+    """
+    return [
+        (config_file, config, read_results(config))
+        for config_file, config in cache_metfrag_batch(spectra, config_params)
+    ]
+
+
+def read_results(
+    config: "MetFragConfig",
+    columns: T.Optional[T.Sequence[str]] = None,
+) -> pd.DataFrame:
+    """
+    Read the cached MetFrag candidates of a config, best first.
+
+    Args:
+        config (MetFragConfig): Config the results were computed with.
+        columns (Sequence[str], optional): Only read these columns, all by default.
+
+    Returns:
+        pd.DataFrame: The candidates, empty if MetFrag found none.
+    """
+    results_csv = get_results_csv(config)
+    try:
+        return pd.read_csv(
+            results_csv,
+            usecols=None if columns is None else lambda column: column in columns,
+        )
+    except FileNotFoundError:
+        return read_compacted_run(config, columns)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame(columns=list(columns or []))
+
+
+def read_compacted_run(
+    config: "MetFragConfig",
+    columns: T.Optional[T.Sequence[str]] = None,
+) -> pd.DataFrame:
+    """
+    Read the results of a config from the Parquet file the manifest points to, see `compact_results`.
+
+    Returns:
+        pd.DataFrame: The candidates, best first, empty if the results were not compacted.
+    """
+    spectrum_hash, config_hash = cache_key(config)
+    entry = get_manifest().lookup(spectrum_hash, config_hash)
+    if entry is None or not entry.output.endswith(".parquet"):
+        return pd.DataFrame(columns=list(columns or []))
+    result = read_compacted_results(
+        entry.output, columns, [spectrum_hash], [config_hash]
     )
+    return result.drop(columns=[*KEY_COLUMNS, POSITION_COLUMN])
+
+
+def iter_results(
+    configs: T.Iterable["MetFragConfig"],
+    columns: T.Optional[T.Sequence[str]] = None,
+) -> T.Iterator[pd.DataFrame]:
+    """
+    Lazily read the cached results of many configs, one at a time.
 
-    # once the process is done, we can delete the config file
-    Path(config_file).unlink(missing_ok=True)
-    return config_file, config, pd.read_csv(results_csv)
+    Args:
+        configs (Iterable[MetFragConfig]): Configs the results were computed with.
+        columns (Sequence[str], optional): Only read these columns, all by default.
+    """
+    for config in configs:
+        yield read_results(config, columns)
+
+
+def split_in_batches(
+    items: T.List[T.Any],
+    batch_size: int,
+) -> T.List[T.List[T.Any]]:
+    """
+    Split spectra (or their per-spectrum config parameters) into batches for `run_metfrag_batch`.
+
+    Larger batches amortize the MetFrag startup over more spectra, smaller ones
+    balance the load better across joblib workers.
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be positive, got {batch_size}.")
+    return [items[x : x + batch_size] for x in range(0, len(items), batch_size)]
@@ -9,6 +9,30 @@ from ms2mol_evaluation.spectrum import Spectrum
 
 load_dotenv()
 ADDUCTS_TO_VALUE = {"[M+H]+": 1, "[M+Na]+": 23}
+# mass added to the neutral molecule by each adduct, as used by MetFrag
+ADDUCTS_TO_MASS = {"[M+H]+": 1.007276, "[M+Na]+": 22.989218}
+LOCAL_DATABASE_SEPARATORS = {"LocalCSV": ",", "LocalPSV": "|"}
+# where MetFrag reads and writes, not what it computes, so left out of the config hash
+PATH_PARAMS = ("PeakListPath", "ResultsPath", "SampleName")
+
+
+def local_database_path(
+    table: str = "lotus",
+    database_type: str = "LocalCSV",
+) -> Path:
+    """
+    Returns the default location of a file-backed candidate database.
+
+    Args:
+        table (str): Name of the candidate table, e.g. "lotus" or "lotus_expanded".
+        database_type (str): One of the MetFrag local database types.
+    """
+    if database_type not in LOCAL_DATABASE_SEPARATORS:
+        raise ValueError(
+            f"Invalid local database type: {database_type}. Must be one of {list(LOCAL_DATABASE_SEPARATORS)}."
+        )
+    extension = database_type.removeprefix("Local").lower()
+    return Path("data/local_database") / f"{table}.{extension}"
 
 
 class MetFragConfig(Hashable):
@@ -28,6 +52,9 @@ class MetFragConfig(Hashable):
             )
 
         adduct_to_int = ADDUCTS_TO_VALUE[adduct_type]
+        if config_params and "MetFragDatabaseType" in config_params:
+            config_params = dict(config_params)
+            database_type = config_params.pop("MetFragDatabaseType")
         self._database_type = database_type
         self._results_path = (
             Path(results_path) if isinstance(results_path, str) else results_path
@@ -81,6 +108,7 @@ class MetFragConfig(Hashable):
         self.set_database_specific_defaults()
 
     def set_database_specific_defaults(self):
+        self._hashes: T.Dict[bool, str] = {}
         if self._database_type == "Postgres":
             self._db_specific_params = {
                 "LocalDatabase": os.getenv("LOTUS_DB_PGDATABASE"),
@@ -98,6 +126,12 @@ class MetFragConfig(Hashable):
                 "LocalDatabaseSmilesColumn": "smiles",
                 "LocalDatabaseCompoundNameColumn": "name",
             }
+        elif self._database_type in LOCAL_DATABASE_SEPARATORS:
+            self._db_specific_params = {
+                "LocalDatabasePath": str(
+                    local_database_path("lotus", self._database_type)
+                ),
+            }
         else:
             raise NotImplementedError(
                 f"Database type '{self._database_type}' is not implemented."
@@ -118,6 +152,7 @@ class MetFragConfig(Hashable):
         return self._universal_params.get(key) or self._db_specific_params.get(key)
 
     def set_param(self, key, value):
+        self._hashes = {}
         if key in self._universal_params:
             self._universal_params[key] = value
         elif key in self._db_specific_params:
@@ -137,15 +172,37 @@ class MetFragConfig(Hashable):
         return result
 
     def consistent_hash(self, use_approximation=False) -> str:
-        return sha256(
-            {
-                key: value
-                for key, value in MetFragConfig._merge_dicts(
-                    self._universal_params, self._db_specific_params
-                ).items()
-            },
-            use_approximation=use_approximation,
-        )
+        """
+        Hash of the parameters MetFrag computes with, excluding the `PATH_PARAMS`.
+
+        It is computed once and kept until a parameter changes, so the hash of a
+        config does not depend on where it is written or run.
+        """
+        if use_approximation not in self._hashes:
+            self._hashes[use_approximation] = sha256(
+                {
+                    key: value
+                    for key, value in MetFragConfig._merge_dicts(
+                        self._universal_params, self._db_specific_params
+                    ).items()
+                    if key not in PATH_PARAMS
+                },
+                use_approximation=use_approximation,
+            )
+        return self._hashes[use_approximation]
+
+    def relocate(
+        self,
+        peak_list_file: T.Union[str, Path],
+        results_path: T.Union[str, Path],
+    ) -> None:
+        """
+        Change where MetFrag reads the peak list and writes the results, keeping the hash.
+        """
+        self._peak_list_file = Path(peak_list_file)
+        self._results_path = Path(results_path)
+        self._universal_params["PeakListPath"] = str(peak_list_file)
+        self._universal_params["ResultsPath"] = str(results_path)
 
     def get_results_path(self) -> Path:
         """
@@ -0,0 +1,201 @@
+import atexit
+import os
+import subprocess
+import typing as T
+import warnings
+from pathlib import Path
+
+METFRAG_JAR = "MetFragCommandLine-2.6.6.jar"
+WORKER_SOURCE = Path(__file__).parent / "java" / "MetFragWorker.java"
+# consecutive jobs after which MetFrag ended the JVM, before giving up on the worker
+MAX_EXITS_AFTER_JOB = 3
+# set to 0 to always run one `java -jar` per spectrum, see `verify_metfrag_worker.py`
+PERSISTENT_WORKER_ENV = "METFRAG_PERSISTENT_WORKER"
+
+
+class MetFragWorker:
+    """
+    A long-lived MetFrag JVM that runs parameter files sent to it over a pipe.
+
+    Starting the JVM and loading the MetFrag classes is paid once per worker
+    instead of once per spectrum. If the JVM dies while running a job it is
+    restarted and the job is retried once. If MetFrag ends the JVM itself
+    after a job (e.g. with `System.exit`), the job is done but the JVM is
+    restarted for the next one, which `stays_up` reports.
+    """
+
+    def __init__(self, jar_path: T.Union[str, Path] = METFRAG_JAR):
+        self._jar_path = str(jar_path)
+        self._process: T.Optional[subprocess.Popen] = None
+        self.n_starts = 0
+        self.exits_after_job = 0
+
+    def command(self) -> T.List[str]:
+        return ["java", "-cp", self._jar_path, str(WORKER_SOURCE), self._jar_path]
+
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    @property
+    def restarts(self) -> int:
+        return max(self.n_starts - 1, 0)
+
+    @property
+    def stays_up(self) -> bool:
+        """Whether the JVM survives its jobs, False once MetFrag ended it after every recent job."""
+        return self.exits_after_job < MAX_EXITS_AFTER_JOB
+
+    def start(self) -> None:
+        """
+        Start the JVM and wait until it is ready to accept jobs.
+
+        Raises:
+            RuntimeError: If the worker does not come up.
+        """
+        self.close()
+        self._process = subprocess.Popen(
+            self.command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self.n_starts += 1
+        if self._process.stdout.readline().strip() != "READY":
+            self.close()
+            raise RuntimeError("MetFrag worker failed to start.")
+
+    def close(self) -> None:
+        if self._process is None:
+            return
+        if self._process.poll() is None:
+            self._process.stdin.close()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        self._process = None
+
+    def _submit(self, config_file: str) -> T.Tuple[T.Optional[str], str]:
+        """Send one job and return (status, message), status is None if the JVM died."""
+        if not self.is_alive():
+            self.start()
+        try:
+            self._process.stdin.write(f"{config_file}\n")
+            self._process.stdin.flush()
+            answer = self._process.stdout.readline()
+        except BrokenPipeError:
+            answer = ""
+
+        if not answer:
+            returncode = self._process.wait()
+            self._process = None
+            return None, str(returncode)
+
+        status, _, message = answer.rstrip("\n").partition("\t")
+        return status, message.partition("\t")[2]
+
+    def run(self, config_file: T.Union[str, Path]) -> None:
+        """
+        Run MetFrag on a parameter file.
+
+        Args:
+            config_file (str | Path): Path to the MetFrag parameter file.
+
+        Raises:
+            RuntimeError: If MetFrag reports an error for this job.
+            subprocess.CalledProcessError: If the JVM crashes twice on this job.
+        """
+        config_file = str(config_file)
+        for _ in range(2):
+            status, message = self._submit(config_file)
+            if status == "OK":
+                self.exits_after_job = 0
+                return
+            if status is not None:
+                raise RuntimeError(f"MetFrag failed on {config_file}: {message}")
+            if message == "0":
+                # MetFrag exited on its own after finishing the job, the JVM
+                # is started again on the next submission.
+                self.exits_after_job += 1
+                return
+        raise subprocess.CalledProcessError(
+            int(message), self.command() + [config_file]
+        )
+
+
+_WORKER: T.Optional[MetFragWorker] = None
+_WORKER_UNAVAILABLE = False
+
+
+def get_metfrag_worker() -> T.Optional[MetFragWorker]:
+    """
+    Return the MetFrag worker of the current process, starting it if needed.
+
+    Each joblib worker process owns one JVM, so running with ``n_jobs`` workers
+    gives a pool of ``n_jobs`` resident MetFrag processes. Returns None when a
+    persistent worker cannot be started (e.g. Java older than 11), or is
+    disabled with ``METFRAG_PERSISTENT_WORKER=0``, in which case callers should
+    fall back to one ``java -jar`` call per spectrum.
+    """
+    global _WORKER, _WORKER_UNAVAILABLE
+    if _WORKER_UNAVAILABLE or os.getenv(PERSISTENT_WORKER_ENV) == "0":
+        return None
+    if _WORKER is None:
+        worker = MetFragWorker()
+        try:
+            worker.start()
+        except (OSError, RuntimeError) as e:
+            warnings.warn(
+                f"Could not start a persistent MetFrag worker ({e}), "
+                "falling back to one JVM per spectrum."
+            )
+            _WORKER_UNAVAILABLE = True
+            return None
+        _WORKER = worker
+        atexit.register(worker.close)
+    return _WORKER
+
+
+def metfrag_mode() -> str:
+    """
+    Returns how the current process runs MetFrag, without starting anything.
+
+    Returns:
+        str: "worker" while the process feeds its jobs to one resident JVM, or
+            "java -jar" once it falls back to one JVM per spectrum, see
+            `get_metfrag_worker`.
+    """
+    if _WORKER_UNAVAILABLE or os.getenv(PERSISTENT_WORKER_ENV) == "0":
+        return "java -jar"
+    return "worker"
+
+
+def run_metfrag_process(config_file: T.Union[str, Path]) -> None:
+    """
+    Run MetFrag on a parameter file, using the resident worker when available.
+
+    Args:
+        config_file (str | Path): Path to the MetFrag parameter file.
+    """
+    global _WORKER, _WORKER_UNAVAILABLE
+    worker = get_metfrag_worker()
+    if worker is not None:
+        worker.run(config_file)
+        if not worker.stays_up:
+            warnings.warn(
+                f"MetFrag ended the JVM after each of the last {worker.exits_after_job} "
+                f"jobs ({worker.restarts} restarts), the persistent worker saves nothing, "
+                "falling back to one JVM per spectrum."
+            )
+            worker.close()
+            _WORKER = None
+            _WORKER_UNAVAILABLE = True
+        return
+
+    subprocess.run(
+        ["java", "-jar", METFRAG_JAR, str(config_file)],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
@@ -0,0 +1,259 @@
+import io
+import mmap
+import re
+import typing as T
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from joblib import Parallel, delayed
+from matchms.filtering import default_filters
+from matchms.importing import load_from_mgf
+
+from ms2mol_evaluation.spectrum import Spectrum
+
+INDEX_COLUMNS = ("offset", "length", "compound_name", "precursor_mz")
+
+
+def find_spectrum_offsets(path: T.Union[str, Path]) -> np.ndarray:
+    """
+    Returns the byte offset of every `BEGIN IONS` line, followed by the file size.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        offsets = [match.start() for match in re.finditer(rb"(?m)^BEGIN IONS", mm)]
+        offsets.append(len(mm))
+    return np.array(offsets, dtype=np.int64)
+
+
+def _read_spectra(
+    path: str,
+    start: int,
+    stop: int,
+    n_spectra: int,
+    apply_filters: bool,
+) -> T.List[Spectrum]:
+    """Parse the spectra stored between two byte offsets of an MGF file."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        text = f.read(stop - start).decode("utf-8")
+    spectra = list(load_from_mgf(io.StringIO(text)))
+    if len(spectra) != n_spectra:
+        raise ValueError(
+            f"Expected {n_spectra} spectra between bytes {start} and {stop} of {path}, parsed {len(spectra)}."
+        )
+    if apply_filters:
+        spectra = [default_filters(spectrum) for spectrum in spectra]
+    return [
+        Spectrum(
+            mz=spectrum.mz,
+            intensities=spectrum.intensities,
+            metadata=spectrum.metadata,
+            metadata_harmonization=False,
+        )
+        for spectrum in spectra
+    ]
+
+
+def _index_spectra(
+    path: str,
+    start: int,
+    stop: int,
+    n_spectra: int,
+) -> T.List[T.Tuple[T.Optional[str], T.Optional[float]]]:
+    return [
+        (spectrum.get("compound_name"), spectrum.get("precursor_mz"))
+        for spectrum in _read_spectra(path, start, stop, n_spectra, False)
+    ]
+
+
+class IndexedMGF:
+    """
+    Random-access, streaming reader for large MGF files.
+
+    The byte range, compound name and precursor m/z of every spectrum are kept
+    in a sidecar index (`<file>.index.parquet`), built once in parallel chunks
+    split on `BEGIN IONS` offsets. Spectra can then be fetched by compound name
+    or precursor mass range, or iterated lazily chunk by chunk, without holding
+    the whole file in memory.
+    """
+
+    def __init__(
+        self,
+        path: T.Union[str, Path],
+        n_jobs: int = -1,
+        chunk_size: int = 1000,
+    ):
+        """
+        Args:
+            path (str | Path): The MGF file.
+            n_jobs (int): Number of processes used to parse chunks.
+            chunk_size (int): Number of spectra parsed per task.
+        """
+        self._path = Path(path)
+        self._n_jobs = n_jobs
+        self._chunk_size = chunk_size
+        self._index_path = self._path.with_name(self._path.name + ".index.parquet")
+        self._index = self._load_index()
+        if self._index is None:
+            self._index = self._build_index()
+        self._mz_order = np.argsort(
+            self._index["precursor_mz"].to_numpy(dtype=np.float64), kind="stable"
+        )
+        self._sorted_mz = self._index["precursor_mz"].to_numpy(dtype=np.float64)[
+            self._mz_order
+        ]
+
+    def _source_signature(self) -> T.Dict[bytes, bytes]:
+        stat = self._path.stat()
+        return {
+            b"source_size": str(stat.st_size).encode(),
+            b"source_mtime_ns": str(stat.st_mtime_ns).encode(),
+        }
+
+    def _load_index(self) -> T.Optional[pd.DataFrame]:
+        if not self._index_path.exists():
+            return None
+        table = pq.read_table(self._index_path)
+        metadata = table.schema.metadata or {}
+        if any(
+            metadata.get(key) != value
+            for key, value in self._source_signature().items()
+        ):
+            return None
+        return table.to_pandas()
+
+    def _chunks(self, positions: np.ndarray) -> T.List[np.ndarray]:
+        """Group positions into runs of consecutive spectra of at most `chunk_size`."""
+        breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+        runs = np.split(positions, breaks) if len(positions) else []
+        return [
+            run[x : x + self._chunk_size]
+            for run in runs
+            for x in range(0, len(run), self._chunk_size)
+        ]
+
+    def _build_index(self) -> pd.DataFrame:
+        offsets = find_spectrum_offsets(self._path)
+        positions = np.arange(len(offsets) - 1)
+        chunks = self._chunks(positions)
+        entries = Parallel(n_jobs=self._n_jobs)(
+            delayed(_index_spectra)(
+                str(self._path),
+                int(offsets[chunk[0]]),
+                int(offsets[chunk[-1] + 1]),
+                len(chunk),
+            )
+            for chunk in chunks
+        )
+        entries = [entry for chunk_entries in entries for entry in chunk_entries]
+        index = pd.DataFrame(
+            {
+                "offset": offsets[:-1],
+                "length": np.diff(offsets),
+                "compound_name": pd.Series(
+                    [entry[0] for entry in entries], dtype=object
+                ),
+                "precursor_mz": pd.Series(
+                    [entry[1] for entry in entries], dtype=np.float64
+                ),
+            },
+            columns=list(INDEX_COLUMNS),
+        )
+        table = pa.Table.from_pandas(index, preserve_index=False)
+        pq.write_table(
+            table.replace_schema_metadata(
+                {**(table.schema.metadata or {}), **self._source_signature()}
+            ),
+            self._index_path,
+        )
+        return index
+
+    @property
+    def index(self) -> pd.DataFrame:
+        """Byte offset, length, compound name and precursor m/z of every spectrum."""
+        return self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, key: str, default=None) -> T.List[T.Any]:
+        """
+        Returns an indexed metadata value ("compound_name" or "precursor_mz") for all spectra.
+        """
+        if key not in ("compound_name", "precursor_mz"):
+            raise KeyError(
+                f"{key} is not indexed, use one of compound_name, precursor_mz."
+            )
+        return [
+            default if value is None or value != value else value
+            for value in self._index[key].tolist()
+        ]
+
+    def iter_spectra(
+        self,
+        positions: T.Optional[T.Sequence[int]] = None,
+        apply_filters: bool = True,
+    ) -> T.Iterator[Spectrum]:
+        """
+        Lazily yield spectra, parsed in parallel chunks.
+
+        Args:
+            positions (Sequence[int], optional): Positions of the spectra to read, all by default.
+            apply_filters (bool): Whether to apply matchms `default_filters`.
+        """
+        positions = (
+            np.arange(len(self))
+            if positions is None
+            else np.asarray(positions, dtype=np.int64)
+        )
+        offsets = self._index["offset"].to_numpy()
+        lengths = self._index["length"].to_numpy()
+        chunks = Parallel(n_jobs=self._n_jobs, return_as="generator")(
+            delayed(_read_spectra)(
+                str(self._path),
+                int(offsets[chunk[0]]),
+                int(offsets[chunk[-1]] + lengths[chunk[-1]]),
+                len(chunk),
+                apply_filters,
+            )
+            for chunk in self._chunks(positions)
+        )
+        for chunk in chunks:
+            yield from chunk
+
+    def __iter__(self) -> T.Iterator[Spectrum]:
+        return self.iter_spectra()
+
+    def read(
+        self,
+        positions: T.Sequence[int],
+        apply_filters: bool = True,
+    ) -> T.List[Spectrum]:
+        """
+        Read the spectra at the given positions, in the given order.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        order = np.argsort(positions, kind="stable")
+        spectra = [None] * len(positions)
+        for i, spectrum in zip(
+            order, self.iter_spectra(positions[order], apply_filters)
+        ):
+            spectra[i] = spectrum
+        return spectra
+
+    def by_compound_name(self, compound_name: str) -> T.List[Spectrum]:
+        """
+        Read all spectra of a compound.
+        """
+        positions = np.flatnonzero(self._index["compound_name"] == compound_name)
+        return self.read(positions)
+
+    def by_precursor_mz(self, low: float, high: float) -> T.List[Spectrum]:
+        """
+        Read all spectra with a precursor m/z in [low, high], sorted by precursor m/z.
+        """
+        start = np.searchsorted(self._sorted_mz, low, side="left")
+        stop = np.searchsorted(self._sorted_mz, high, side="right")
+        return self.read(self._mz_order[start:stop])
@@ -0,0 +1,320 @@
+import io
+import os
+import typing as T
+
+import pandas as pd
+import psycopg2
+from tqdm import tqdm
+
+# MetFrag column of the candidate DataFrames -> column of the Postgres tables
+CANDIDATE_COLUMNS = {
+    "Identifier": "identifier",
+    "InChI": "inchi",
+    "MonoisotopicMass": "monoisotopic_mass",
+    "MolecularFormula": "formula",
+    "InChIKey1": "inchikey_1",
+    "InChIKey2": "inchikey_2",
+    "SMILES": "smiles",
+    "Name": "name",
+    "InChIKey3": "inchikey_3",
+}
+MANIFEST_TABLE = "build_manifest"
+# pg_class relkind -> ALTER statement
+RELATION_KINDS = {
+    "r": "TABLE",
+    "p": "TABLE",
+    "i": "INDEX",
+    "I": "INDEX",
+    "S": "SEQUENCE",
+}
+
+
+def connect():
+    """
+    Connect to the candidate database configured in the LOTUS_DB_* environment variables.
+    """
+    return psycopg2.connect(
+        database=os.getenv("LOTUS_DB_PGDATABASE"),
+        host=os.getenv("LOTUS_DB_PGHOST"),
+        port=os.getenv("LOTUS_DB_PGPORT"),
+        user=os.getenv("LOTUS_DB_POSTGRES_USER"),
+        password=os.getenv("LOTUS_DB_POSTGRES_PASSWORD"),
+    )
+
+
+def table_exists(conn, table: str) -> bool:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+        return cursor.fetchone()[0]
+
+
+def fetch_values(
+    conn,
+    table: str,
+    column: str,
+    itersize: int = 100000,
+) -> T.Set[str]:
+    """
+    Returns the distinct values of a column, streamed through a server-side cursor.
+    """
+    with conn, conn.cursor(name=f"fetch_{table}_{column}") as cursor:
+        cursor.itersize = itersize
+        cursor.execute(f"SELECT DISTINCT {column} FROM {table}")
+        return {value for (value,) in cursor}
+
+
+def copy_dataframe(
+    cursor,
+    df: pd.DataFrame,
+    table: str,
+    columns: T.Dict[str, str] = CANDIDATE_COLUMNS,
+    batch_size: int = 100000,
+) -> int:
+    """
+    Stream a DataFrame into a table with `COPY ... FROM STDIN`.
+
+    Rows are sent as CSV, `batch_size` rows at a time, so only one batch is
+    serialized in memory at once.
+
+    Args:
+        cursor: psycopg2 cursor.
+        df (pd.DataFrame): Rows to copy.
+        table (str): Destination table.
+        columns (Dict[str, str]): DataFrame column -> table column.
+        batch_size (int): Number of rows serialized per COPY.
+
+    Returns:
+        int: Number of copied rows.
+    """
+    query = f"COPY {table} ({', '.join(columns.values())}) FROM STDIN WITH (FORMAT csv)"
+    df = df[list(columns)]
+    for i in range(0, len(df), batch_size):
+        buffer = io.StringIO()
+        df.iloc[i : i + batch_size].to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        cursor.copy_expert(query, buffer)
+    return len(df)
+
+
+def _staging_relations(
+    cursor,
+    staging: str,
+    kinds: str,
+) -> T.List[T.Tuple[str, str, str]]:
+    """
+    Returns the name, kind and persistence of a staging table and the relations it owns.
+
+    The relations are looked up by oid, not by name: the table, its partitions
+    (`pg_inherits`), their indexes (`pg_index`) and the sequences of their
+    serial or identity columns (`pg_depend`), so unrelated relations whose
+    name contains the staging name are left alone.
+    """
+    cursor.execute(
+        """
+WITH RECURSIVE tables (oid) AS (
+    SELECT %s::regclass::oid
+    UNION
+    SELECT i.inhrelid FROM pg_inherits i JOIN tables t ON i.inhparent = t.oid
+), relations (oid) AS (
+    SELECT oid FROM tables
+    UNION
+    SELECT indexrelid FROM pg_index WHERE indrelid IN (SELECT oid FROM tables)
+    UNION
+    SELECT objid FROM pg_depend
+    WHERE classid = 'pg_class'::regclass AND refclassid = 'pg_class'::regclass
+    AND refobjid IN (SELECT oid FROM tables) AND deptype IN ('a', 'i')
+)
+SELECT c.relname, c.relkind, c.relpersistence
+FROM pg_class c JOIN relations r ON c.oid = r.oid
+WHERE strpos(%s, c.relkind::text) > 0
+""",
+        (staging, kinds),
+    )
+    return cursor.fetchall()
+
+
+def _swap_table(cursor, staging: str, table: str) -> None:
+    """
+    Replace `table` by `staging`, renaming its partitions, indexes and sequences to match.
+    """
+    relations = _staging_relations(cursor, staging, "rpiIS")
+    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    for name, kind, _ in relations:
+        if staging in name:
+            cursor.execute(
+                f"ALTER {RELATION_KINDS[kind]} {name} RENAME TO {name.replace(staging, table)}"
+            )
+
+
+def _vacuum(conn, table: str) -> None:
+    # VACUUM cannot run in a transaction block
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f"VACUUM {table}")
+    conn.autocommit = autocommit
+
+
+def bulk_load(
+    conn,
+    batches: T.Union[pd.DataFrame, T.Iterable[pd.DataFrame]],
+    table: str,
+    table_query: T.Callable[..., str],
+    index_query: T.Callable[[str], str],
+) -> int:
+    """
+    Rebuild a candidate table from DataFrames with `COPY` and swap it in atomically.
+
+    The rows are copied into an unlogged `<table>_staging` table (or unlogged
+    partitions of it), which has no index during the load. Indexes are built
+    afterwards, then the staging table is made durable and renamed over
+    `table`. Everything runs in one transaction, so readers of `table` see
+    either the previous or the complete new table, and a failed load leaves the
+    previous table untouched. The new table is then vacuumed, so covering
+    indexes can serve index-only scans right away.
+
+    Making the staging table durable (`SET LOGGED`) rewrites it and its
+    indexes into the WAL (unless `wal_level = minimal`), so the unlogged load
+    mostly saves the WAL of the row by row COPY and of the index builds, and
+    the table is still written to the WAL once, in bulk.
+
+    Args:
+        conn: psycopg2 connection, not in autocommit mode.
+        batches (pd.DataFrame | Iterable[pd.DataFrame]): Rows with the MetFrag columns,
+            in one DataFrame or as a stream of batches.
+        table (str): Name of the table to (re)build.
+        table_query (Callable): Returns the table definition for `(table_name, unlogged=...)`.
+        index_query (Callable): Returns the index definitions for a table name.
+
+    Returns:
+        int: Number of loaded rows.
+    """
+    if isinstance(batches, pd.DataFrame):
+        batches = [batches]
+    staging = f"{table}_staging"
+    n_rows = 0
+    with conn, conn.cursor() as cursor:
+        cursor.execute(table_query(staging, unlogged=True))
+        for batch in tqdm(batches, desc=f"Copying into {staging}", leave=False):
+            n_rows += copy_dataframe(cursor, batch, staging)
+        cursor.execute(index_query(staging))
+        cursor.execute(f"ANALYZE {staging}")
+        for name, _, persistence in _staging_relations(cursor, staging, "r"):
+            if persistence == "u":
+                cursor.execute(f"ALTER TABLE {name} SET LOGGED")
+        _swap_table(cursor, staging, table)
+    _vacuum(conn, table)
+    return n_rows
+
+
+def upsert(
+    conn,
+    batches: T.Union[pd.DataFrame, T.Iterable[pd.DataFrame]],
+    table: str,
+    key: str = "inchikey_1",
+) -> int:
+    """
+    Add the rows of DataFrames whose `key` is not yet in an existing candidate table.
+
+    Each batch is copied into a temporary table and inserted from there, rows
+    whose key already exists are skipped. All batches are added in one
+    transaction, so readers see either none or all of the new rows.
+
+    Args:
+        conn: psycopg2 connection, not in autocommit mode.
+        batches (pd.DataFrame | Iterable[pd.DataFrame]): Rows with the MetFrag columns.
+        table (str): The existing table.
+        key (str): Column identifying a candidate, indexed if not already.
+
+    Returns:
+        int: Number of inserted rows.
+    """
+    if isinstance(batches, pd.DataFrame):
+        batches = [batches]
+    staging = f"{table}_upsert"
+    columns = ", ".join(CANDIDATE_COLUMNS.values())
+    n_rows = 0
+    with conn, conn.cursor() as cursor:
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_{key} ON {table} ({key})"
+        )
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA"
+        )
+        for batch in tqdm(batches, desc=f"Upserting into {table}", leave=False):
+            cursor.execute(f"TRUNCATE {staging}")
+            copy_dataframe(cursor, batch, staging)
+            cursor.execute(
+                f"""
+INSERT INTO {table} ({columns})
+SELECT {columns} FROM {staging} s
+WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{key} = s.{key})
+"""
+            )
+            n_rows += cursor.rowcount
+        cursor.execute(f"ANALYZE {table}")
+    _vacuum(conn, table)
+    return n_rows
+
+
+def create_manifest_query():
+    query = f"""
+CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+    id SERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    source_count BIGINT NOT NULL,
+    inserted_rows BIGINT NOT NULL,
+    total_rows BIGINT NOT NULL,
+    built_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+    return query
+
+
+def record_build(
+    conn,
+    table: str,
+    mode: str,
+    source_hash: str,
+    source_count: int,
+    inserted_rows: int,
+) -> None:
+    """
+    Add an entry for a build of `table` to the build manifest.
+
+    Args:
+        conn: psycopg2 connection.
+        table (str): The built table.
+        mode (str): "full" or "incremental".
+        source_hash (str): Hash of the source snapshot the table was built from.
+        source_count (int): Number of source structures.
+        inserted_rows (int): Number of rows added by the build.
+    """
+    with conn, conn.cursor() as cursor:
+        cursor.execute(create_manifest_query())
+        cursor.execute(
+            f"""
+INSERT INTO {MANIFEST_TABLE} (
+    table_name, mode, source_hash, source_count, inserted_rows, total_rows
+) SELECT %s, %s, %s, %s, %s, count(*) FROM {table}
+""",
+            (table, mode, source_hash, source_count, inserted_rows),
+        )
+
+
+def last_build(conn, table: str) -> T.Optional[T.Dict[str, T.Any]]:
+    """
+    Returns the latest build manifest entry of a table, None if it was never recorded.
+    """
+    with conn, conn.cursor() as cursor:
+        cursor.execute(create_manifest_query())
+        cursor.execute(
+            f"SELECT * FROM {MANIFEST_TABLE} WHERE table_name = %s ORDER BY id DESC LIMIT 1",
+            (table,),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column.name for column in cursor.description], row))
@@ -0,0 +1,95 @@
+import typing as T
+
+import numpy as np
+
+from ms2mol_evaluation.spectrum import Spectrum
+from ms2mol_evaluation.spectrum_store import SpectrumStore, get_metadata
+
+
+class PrecursorIndex:
+    """
+    Sorted precursor m/z index of a spectral library.
+
+    Matching a batch of queries costs two binary searches per query plus the
+    number of matching pairs, instead of a dense query x library comparison.
+    Matches are the same as matchms `PrecursorMzMatch` with the same tolerance.
+    """
+
+    def __init__(self, precursor_mzs: T.Sequence[float]):
+        """
+        Args:
+            precursor_mzs (Sequence[float]): Precursor m/z of every library spectrum, None if unknown.
+        """
+        mzs = np.array(
+            [np.nan if mz is None else mz for mz in precursor_mzs], dtype=np.float64
+        )
+        self._order = np.argsort(mzs, kind="stable")
+        self._sorted_mzs = mzs[self._order]
+
+    @classmethod
+    def from_spectra(
+        cls,
+        spectra: T.Union[SpectrumStore, T.List[Spectrum]],
+    ) -> "PrecursorIndex":
+        return cls(get_metadata(spectra, "precursor_mz"))
+
+    def __len__(self) -> int:
+        return len(self._sorted_mzs)
+
+    def match(
+        self,
+        query_mzs: T.Sequence[float],
+        tolerance: float = 10.0,
+        tolerance_type: str = "ppm",
+    ) -> T.Tuple[np.ndarray, np.ndarray]:
+        """
+        Find all (query, library) pairs with matching precursor m/z.
+
+        Args:
+            query_mzs (Sequence[float]): Precursor m/z of the queries, None if unknown.
+            tolerance (float): Maximum precursor m/z difference.
+            tolerance_type (str): "ppm" (relative to the mean of both m/z, as in matchms) or "Dalton".
+
+        Returns:
+            tuple: Query positions and library positions of the matching pairs,
+                sorted by query then library position.
+        """
+        queries = np.array(
+            [np.nan if mz is None else mz for mz in query_mzs], dtype=np.float64
+        )
+        if tolerance_type == "ppm":
+            half = tolerance * 1e-6 / 2
+            low = queries * (1 - half) / (1 + half)
+            high = queries * (1 + half) / (1 - half)
+        elif tolerance_type == "Dalton":
+            low = queries - tolerance
+            high = queries + tolerance
+        else:
+            raise ValueError(
+                f"Invalid tolerance type: {tolerance_type}. Must be one of ['ppm', 'Dalton']."
+            )
+
+        # widen the search by a float rounding margin, the exact test happens below
+        margin = np.abs(queries) * 1e-12
+        start = np.searchsorted(self._sorted_mzs, low - margin, side="left")
+        stop = np.searchsorted(self._sorted_mzs, high + margin, side="right")
+        counts = np.where(np.isnan(queries), 0, stop - start)
+
+        query_positions = np.repeat(np.arange(len(queries)), counts)
+        first = np.cumsum(counts) - counts
+        sorted_positions = np.arange(counts.sum()) - np.repeat(first - start, counts)
+
+        query_mz = queries[query_positions]
+        library_mz = self._sorted_mzs[sorted_positions]
+        if tolerance_type == "ppm":
+            keep = (
+                np.abs(query_mz - library_mz) / ((query_mz + library_mz) / 2) * 1e6
+                <= tolerance
+            )
+        else:
+            keep = np.abs(query_mz - library_mz) <= tolerance
+
+        query_positions = query_positions[keep]
+        library_positions = self._order[sorted_positions[keep]]
+        order = np.lexsort((library_positions, query_positions))
+        return query_positions[order], library_positions[order]
@@ -0,0 +1,181 @@
+import shutil
+import typing as T
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from ms2mol_evaluation.manifest import CompletionManifest, get_manifest
+
+RESULTS_DATASET_PATH = Path("data/metfrag_results")
+KEY_COLUMNS = ("config_hash", "spectrum_hash")
+# position of the candidate in the MetFrag output, best first
+POSITION_COLUMN = "position"
+# types of the MetFrag columns that are not strings, every other column is read as a string
+PINNED_TYPES = {
+    "Score": pa.float64(),
+    "FragmenterScore": pa.float64(),
+    "MonoisotopicMass": pa.float64(),
+    "NoExplPeaks": pa.int64(),
+    "NumberPeaksUsed": pa.int64(),
+    "MaximumTreeDepth": pa.int64(),
+}
+
+
+def read_results_table(
+    results_csv: T.Union[str, Path],
+    spectrum_hash: str,
+    config_hash: str,
+) -> pa.Table:
+    """
+    Read a MetFrag results CSV with pinned types, keyed by its spectrum and config hashes.
+
+    InChIKeys, identifiers and every other non-numeric column are always strings,
+    so the tables of all spectra share one schema.
+    """
+    names = pv.open_csv(results_csv).schema.names
+    table = pv.read_csv(
+        results_csv,
+        convert_options=pv.ConvertOptions(
+            strings_can_be_null=True,
+            column_types={name: PINNED_TYPES.get(name, pa.string()) for name in names},
+        ),
+    )
+    n_rows = table.num_rows
+    return (
+        table.append_column(POSITION_COLUMN, pa.array(range(n_rows), type=pa.int32()))
+        .append_column(
+            "spectrum_hash", pa.array([spectrum_hash] * n_rows, type=pa.string())
+        )
+        .append_column(
+            "config_hash", pa.array([config_hash] * n_rows, type=pa.string())
+        )
+    )
+
+
+def compact_results(
+    path: T.Union[str, Path] = RESULTS_DATASET_PATH,
+    manifest: T.Optional[CompletionManifest] = None,
+    spectra_per_file: int = 10000,
+    row_group_size: int = 65536,
+    remove_cache: bool = False,
+) -> int:
+    """
+    Merge the per-spectrum MetFrag CSVs of the cache into a Parquet dataset.
+
+    Every run the completion manifest records as done and whose results are
+    still a CSV is appended, `spectra_per_file` spectra per Parquet file. The
+    rows of a file are sorted by config and spectrum hash, so the row group
+    statistics let readers filtering on them skip the other row groups. The
+    manifest then points the runs to their Parquet file, which `read_results`
+    falls back to once the cache directories are removed.
+
+    Args:
+        path (str | Path): Directory of the dataset.
+        manifest (CompletionManifest, optional): Defaults to the manifest of the cache.
+        spectra_per_file (int): Number of spectra per Parquet file.
+        row_group_size (int): Maximum number of rows per row group.
+        remove_cache (bool): Whether to delete the cache directories once compacted.
+
+    Returns:
+        int: Number of compacted spectra.
+    """
+    manifest = manifest or get_manifest()
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    runs = manifest.to_frame()
+    runs = runs[(runs["status"] == "done") & runs["output"].str.endswith(".csv")]
+    runs = runs.sort_values(list(KEY_COLUMNS)).reset_index(drop=True)
+
+    for start in tqdm(
+        range(0, len(runs), spectra_per_file), desc="Compacting MetFrag results"
+    ):
+        chunk = runs.iloc[start : start + spectra_per_file]
+        table = pa.concat_tables(
+            [
+                read_results_table(output, spectrum_hash, config_hash)
+                for spectrum_hash, config_hash, output in chunk[
+                    ["spectrum_hash", "config_hash", "output"]
+                ].itertuples(index=False)
+            ],
+            promote_options="default",
+        )
+        part = path / f"part-{uuid.uuid4().hex}.parquet"
+        tmp = part.with_suffix(".tmp")
+        pq.write_table(table, tmp, row_group_size=row_group_size)
+        tmp.rename(part)
+
+        for spectrum_hash, config_hash, output in chunk[
+            ["spectrum_hash", "config_hash", "output"]
+        ].itertuples(index=False):
+            manifest.set_output(spectrum_hash, config_hash, part)
+            if remove_cache:
+                shutil.rmtree(Path(output).parent, ignore_errors=True)
+    return len(runs)
+
+
+def results_dataset(
+    path: T.Union[str, Path] = RESULTS_DATASET_PATH,
+) -> ds.Dataset:
+    """
+    Returns the compacted results as a pyarrow dataset, with the union of the file schemas.
+    """
+    files = sorted(str(file) for file in Path(path).glob("*.parquet"))
+    if not files:
+        raise FileNotFoundError(f"No compacted MetFrag results in {path}.")
+    schema = pa.unify_schemas([pq.read_schema(file) for file in files])
+    return ds.dataset(files, schema=schema, format="parquet")
+
+
+def read_compacted_results(
+    path: T.Union[str, Path] = RESULTS_DATASET_PATH,
+    columns: T.Optional[T.Sequence[str]] = None,
+    spectrum_hashes: T.Optional[T.Sequence[str]] = None,
+    config_hashes: T.Optional[T.Sequence[str]] = None,
+) -> pd.DataFrame:
+    """
+    Read the compacted MetFrag results, only decoding the requested columns.
+
+    Args:
+        path (str | Path): Directory of the dataset, or a single Parquet file of it.
+        columns (Sequence[str], optional): MetFrag columns to read, all by default.
+            The key and position columns are always read.
+        spectrum_hashes (Sequence[str], optional): Only read these spectra.
+        config_hashes (Sequence[str], optional): Only read these configs.
+
+    Returns:
+        pd.DataFrame: The candidates, sorted by config, spectrum and position.
+    """
+    path = Path(path)
+    dataset = (
+        ds.dataset(str(path), format="parquet")
+        if path.is_file()
+        else results_dataset(path)
+    )
+    keys = [*KEY_COLUMNS, POSITION_COLUMN]
+    if columns is not None:
+        columns = keys + [
+            column
+            for column in columns
+            if column not in keys and column in dataset.schema.names
+        ]
+    filters = []
+    if spectrum_hashes is not None:
+        filters.append(pc.field("spectrum_hash").isin(list(spectrum_hashes)))
+    if config_hashes is not None:
+        filters.append(pc.field("config_hash").isin(list(config_hashes)))
+    expression = None
+    for condition in filters:
+        expression = condition if expression is None else expression & condition
+    table = dataset.to_table(columns=columns, filter=expression)
+    return (
+        table.sort_by([(key, "ascending") for key in keys])
+        .to_pandas()
+        .reset_index(drop=True)
+    )
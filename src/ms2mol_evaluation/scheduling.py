@@ -0,0 +1,140 @@
+import heapq
+import typing as T
+
+import numpy as np
+import pandas as pd
+
+from ms2mol_evaluation.manifest import CompletionManifest, get_manifest
+from ms2mol_evaluation.spectrum import Spectrum, hash_spectra
+
+COST_FEATURES = ("log_candidates", "log_peaks", "log_precursor_mz")
+# without recorded runtimes, the cost is (1 + candidates) * (1 + peaks) * precursor m/z,
+# in arbitrary units: MetFrag fragments every candidate and matches the fragments
+# against every peak, and heavier candidates have larger fragment trees
+DEFAULT_WEIGHTS = (0.0, 1.0, 1.0, 1.0)
+SCHEDULES = ("random", "cost")
+
+
+def cost_features(
+    spectra: T.List[Spectrum],
+    candidate_counts: T.Optional[T.Sequence[int]] = None,
+) -> pd.DataFrame:
+    """
+    Returns the features the MetFrag runtime of every spectrum is predicted from.
+
+    Args:
+        spectra (List[Spectrum]): The spectra.
+        candidate_counts (Sequence[int], optional): Number of candidates in the mass
+            window of every spectrum, e.g. from `CandidateIndex.candidate_counts`.
+            Without them, the cost only depends on the peaks and precursor m/z.
+    """
+    if candidate_counts is None:
+        candidate_counts = np.zeros(len(spectra))
+    return pd.DataFrame(
+        {
+            "log_candidates": np.log1p(np.asarray(candidate_counts, dtype=np.float64)),
+            "log_peaks": np.log1p([len(spectrum.peaks) for spectrum in spectra]),
+            "log_precursor_mz": np.log(
+                [float(spectrum.get("precursor_mz") or 1.0) for spectrum in spectra]
+            ),
+        }
+    )
+
+
+class CostModel:
+    """
+    Log-linear model of the MetFrag runtime of a spectrum.
+
+    log(runtime) = w0 + w1 log(1 + candidates) + w2 log(1 + peaks) + w3 log(precursor m/z)
+
+    Fitted on recorded runtimes, it predicts seconds. Until then, it uses
+    `DEFAULT_WEIGHTS`, which only rank the spectra by cost.
+    """
+
+    def __init__(self, weights: T.Sequence[float] = DEFAULT_WEIGHTS):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.n_samples = 0
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.n_samples > 0
+
+    @staticmethod
+    def _design(features: pd.DataFrame) -> np.ndarray:
+        values = features[list(COST_FEATURES)].to_numpy(dtype=np.float64)
+        return np.hstack([np.ones((len(values), 1)), values])
+
+    def fit(self, features: pd.DataFrame, runtimes: T.Sequence[float]) -> "CostModel":
+        """
+        Fit the weights on the runtimes (s) of the spectra that have one, NaN otherwise.
+
+        The model is left unchanged with fewer runtimes than weights.
+        """
+        runtimes = np.asarray(runtimes, dtype=np.float64)
+        known = np.isfinite(runtimes) & (runtimes > 0)
+        if known.sum() < len(self.weights):
+            return self
+        self.weights = np.linalg.lstsq(
+            self._design(features)[known], np.log(runtimes[known]), rcond=None
+        )[0]
+        self.n_samples = int(known.sum())
+        return self
+
+    def predict(self, features: pd.DataFrame) -> np.ndarray:
+        return np.exp(self._design(features) @ self.weights)
+
+
+def recorded_runtimes(
+    spectra: T.List[Spectrum],
+    manifest: T.Optional[CompletionManifest] = None,
+) -> pd.DataFrame:
+    """
+    Returns every runtime (s) the manifest recorded for the spectra, with any config.
+
+    The runs of the requested configs are usually cached already, so the model
+    is trained on the runs of the same spectra with every other config, e.g.
+    the previous points of a sweep. Failed runs are left out.
+
+    Returns:
+        pd.DataFrame: The "position" of the spectrum in `spectra` and the "runtime"
+            of each recorded run, a spectrum can have several.
+    """
+    manifest = manifest or get_manifest()
+    positions = pd.DataFrame(
+        {"spectrum_hash": hash_spectra(spectra), "position": np.arange(len(spectra))}
+    )
+    runs = manifest.to_frame()
+    runs = runs.loc[
+        (runs["status"] != "failed") & (runs["runtime"] > 0),
+        ["spectrum_hash", "runtime"],
+    ]
+    return positions.merge(runs, on="spectrum_hash")[["position", "runtime"]]
+
+
+def predict_costs(
+    spectra: T.List[Spectrum],
+    candidate_counts: T.Optional[T.Sequence[int]] = None,
+    manifest: T.Optional[CompletionManifest] = None,
+) -> T.Tuple[np.ndarray, CostModel]:
+    """
+    Predict the MetFrag runtime of every spectrum with a model fitted on the recorded ones.
+
+    Returns:
+        tuple: The predicted cost of every spectrum and the cost model.
+    """
+    features = cost_features(spectra, candidate_counts)
+    runs = recorded_runtimes(spectra, manifest)
+    model = CostModel().fit(
+        features.iloc[runs["position"]], runs["runtime"].to_numpy(dtype=np.float64)
+    )
+    return model.predict(features), model
+
+
+def simulate_makespan(costs: T.Sequence[float], n_workers: int) -> float:
+    """
+    Makespan of dispatching jobs in order, each to the first worker to become free.
+    """
+    workers = [0.0] * max(n_workers, 1)
+    for cost in costs:
+        heapq.heappush(workers, heapq.heappop(workers) + cost)
+    return max(workers)
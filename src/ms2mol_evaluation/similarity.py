@@ -0,0 +1,194 @@
+import typing as T
+
+import numpy as np
+from numba import njit, prange
+
+from ms2mol_evaluation.spectrum import Spectrum
+from ms2mol_evaluation.spectrum_store import SpectrumStore
+
+SCORE_DATATYPE = [("score", np.float64), ("matches", "int")]
+
+
+def peak_arrays(
+    spectra: T.Union[SpectrumStore, T.List[Spectrum]],
+) -> T.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the flat m/z and intensity buffers of the spectra and their row offsets.
+
+    Stores already hold their peaks this way and are returned without copying.
+    """
+    if isinstance(spectra, SpectrumStore):
+        return spectra.mz, spectra.intensities, np.asarray(spectra.offsets)
+    offsets = np.zeros(len(spectra) + 1, dtype=np.int64)
+    np.cumsum([len(spectrum.mz) for spectrum in spectra], out=offsets[1:])
+    if not spectra:
+        return np.empty(0), np.empty(0), offsets
+    mz = np.concatenate([spectrum.mz for spectrum in spectra])
+    intensities = np.concatenate([spectrum.intensities for spectrum in spectra])
+    return mz, intensities, offsets
+
+
+@njit(cache=True)
+def _norms(mz, intensities, offsets, mz_power, intensity_power):
+    norms = np.empty(len(offsets) - 1)
+    for i in range(len(offsets) - 1):
+        power = (
+            mz[offsets[i] : offsets[i + 1]] ** mz_power
+            * intensities[offsets[i] : offsets[i + 1]] ** intensity_power
+        )
+        norms[i] = np.sum(power**2) ** 0.5
+    return norms
+
+
+@njit(cache=True)
+def _cosine_greedy(
+    mz1,
+    intensities1,
+    norm1,
+    mz2,
+    intensities2,
+    norm2,
+    tolerance,
+    mz_power,
+    intensity_power,
+):
+    """Greedy cosine of one pair, following matchms' CosineGreedy step by step."""
+    # find matching peaks, both spectra are sorted by m/z
+    n_matches = 0
+    lowest_idx = 0
+    for i in range(len(mz1)):
+        for j in range(lowest_idx, len(mz2)):
+            if mz2[j] > mz1[i] + tolerance:
+                break
+            if mz2[j] < mz1[i] - tolerance:
+                lowest_idx = j + 1
+            else:
+                n_matches += 1
+    if n_matches == 0:
+        return 0.0, 0
+
+    idx1 = np.empty(n_matches, dtype=np.int64)
+    idx2 = np.empty(n_matches, dtype=np.int64)
+    products = np.empty(n_matches)
+    k = 0
+    lowest_idx = 0
+    for i in range(len(mz1)):
+        for j in range(lowest_idx, len(mz2)):
+            if mz2[j] > mz1[i] + tolerance:
+                break
+            if mz2[j] < mz1[i] - tolerance:
+                lowest_idx = j + 1
+            else:
+                idx1[k] = i
+                idx2[k] = j
+                products[k] = (
+                    mz1[i] ** mz_power * intensities1[i] ** intensity_power
+                ) * (mz2[j] ** mz_power * intensities2[j] ** intensity_power)
+                k += 1
+
+    # highest products first, ties in the same order as matchms' reversed stable sort
+    order = np.argsort(products, kind="mergesort")[::-1]
+    used1 = np.zeros(len(mz1), dtype=np.bool_)
+    used2 = np.zeros(len(mz2), dtype=np.bool_)
+    score = 0.0
+    used_matches = 0
+    for k in order:
+        if not used1[idx1[k]] and not used2[idx2[k]]:
+            score += products[k]
+            used1[idx1[k]] = True
+            used2[idx2[k]] = True
+            used_matches += 1
+    return score / (norm1 * norm2), used_matches
+
+
+@njit(parallel=True, cache=True)
+def _cosine_greedy_pairs(
+    mz1,
+    intensities1,
+    offsets1,
+    norms1,
+    mz2,
+    intensities2,
+    offsets2,
+    norms2,
+    positions1,
+    positions2,
+    tolerance,
+    mz_power,
+    intensity_power,
+):
+    scores = np.empty(len(positions1))
+    matches = np.empty(len(positions1), dtype=np.int64)
+    for k in prange(len(positions1)):
+        i = positions1[k]
+        j = positions2[k]
+        scores[k], matches[k] = _cosine_greedy(
+            mz1[offsets1[i] : offsets1[i + 1]],
+            intensities1[offsets1[i] : offsets1[i + 1]],
+            norms1[i],
+            mz2[offsets2[j] : offsets2[j + 1]],
+            intensities2[offsets2[j] : offsets2[j + 1]],
+            norms2[j],
+            tolerance,
+            mz_power,
+            intensity_power,
+        )
+    return scores, matches
+
+
+def cosine_greedy_pairs(
+    queries: T.Union[SpectrumStore, T.List[Spectrum]],
+    references: T.Union[SpectrumStore, T.List[Spectrum]],
+    query_positions: T.Sequence[int],
+    reference_positions: T.Sequence[int],
+    tolerance: float = 0.1,
+    mz_power: float = 0.0,
+    intensity_power: float = 1.0,
+) -> np.ndarray:
+    """
+    Greedy cosine similarity of many (query, reference) pairs in one compiled call.
+
+    Gives the same scores and matched peak counts as
+    `CosineGreedy(tolerance, mz_power, intensity_power).pair(queries[i], references[j])`
+    for every pair, computed in parallel over flat peak arrays.
+
+    Args:
+        queries (SpectrumStore | List[Spectrum]): Query spectra.
+        references (SpectrumStore | List[Spectrum]): Reference spectra.
+        query_positions (Sequence[int]): Query position of every pair.
+        reference_positions (Sequence[int]): Reference position of every pair.
+        tolerance (float): Peaks match when their m/z are at most this far apart.
+        mz_power (float): Power of the m/z in the peak weights.
+        intensity_power (float): Power of the intensities in the peak weights.
+
+    Returns:
+        np.ndarray: Structured array with "score" and "matches" for every pair.
+    """
+    query_positions = np.asarray(query_positions, dtype=np.int64)
+    reference_positions = np.asarray(reference_positions, dtype=np.int64)
+    if len(query_positions) != len(reference_positions):
+        raise ValueError(
+            "query_positions and reference_positions must have the same length."
+        )
+
+    mz1, intensities1, offsets1 = peak_arrays(queries)
+    mz2, intensities2, offsets2 = peak_arrays(references)
+    scores, matches = _cosine_greedy_pairs(
+        mz1,
+        intensities1,
+        offsets1,
+        _norms(mz1, intensities1, offsets1, mz_power, intensity_power),
+        mz2,
+        intensities2,
+        offsets2,
+        _norms(mz2, intensities2, offsets2, mz_power, intensity_power),
+        query_positions,
+        reference_positions,
+        float(tolerance),
+        float(mz_power),
+        float(intensity_power),
+    )
+    result = np.empty(len(scores), dtype=SCORE_DATATYPE)
+    result["score"] = scores
+    result["matches"] = matches
+    return result
@@ -1,19 +1,123 @@
+import hashlib
+import typing as T
+
+import numpy as np
 from dict_hash import Hashable, sha256
 from matchms import Spectrum as MatchmsSpectrum
 
+# precisions and length of the matchms spectrum hash
+MZ_PRECISION = 5
+INTENSITY_PRECISION = 2
+HASH_LENGTH = 20
+
 
 class Spectrum(MatchmsSpectrum, Hashable):
     """A Spectrum class that extends the matchms Spectrum so that we can use it in the cache_decorator package."""
 
     def __init__(self, *args, **kwargs):
+        # the hashes are kept until the peaks or metadata change
+        self._hashes: T.Dict[T.Tuple[str, bool], str] = {}
         super().__init__(*args, **kwargs)
 
+    def _memoize(self, key: T.Tuple[str, bool], compute: T.Callable[[], str]) -> str:
+        # spectra pickled before the hashes were memoized have no cache
+        hashes = self.__dict__.setdefault("_hashes", {})
+        if key not in hashes:
+            hashes[key] = compute()
+        return hashes[key]
+
+    def set(self, key: str, value):
+        self._hashes = {}
+        return super().set(key, value)
+
+    @MatchmsSpectrum.peaks.setter
+    def peaks(self, value):
+        self._hashes = {}
+        MatchmsSpectrum.peaks.fset(self, value)
+
+    @MatchmsSpectrum.metadata.setter
+    def metadata(self, value):
+        self._hashes = {}
+        MatchmsSpectrum.metadata.fset(self, value)
+
+    def spectrum_hash(self) -> str:
+        return self._memoize(("spectrum", False), super().spectrum_hash)
+
+    def metadata_hash(self) -> str:
+        return self._memoize(("metadata", False), super().metadata_hash)
+
     def consistent_hash(self, use_approximation: bool = False) -> str:
         """Return a consistent hash of the Spectrum object."""
-        return sha256(
-            {
-                "spectrum_hash": super().spectrum_hash(),
-                "metadata_hash": super().metadata_hash(),
-            },
-            use_approximation=use_approximation,
+        return self._memoize(
+            ("consistent", use_approximation),
+            lambda: sha256(
+                {
+                    "spectrum_hash": self.spectrum_hash(),
+                    "metadata_hash": self.metadata_hash(),
+                },
+                use_approximation=use_approximation,
+            ),
+        )
+
+
+def peak_hashes(
+    mz: np.ndarray,
+    intensities: np.ndarray,
+    offsets: np.ndarray,
+) -> T.List[str]:
+    """
+    The matchms spectrum hash of many spectra, from their concatenated peaks.
+
+    The peaks of all spectra are rounded and sorted in one pass, only the
+    final encoding and sha256 are done per spectrum.
+
+    Args:
+        mz (np.ndarray): m/z of the peaks of all spectra.
+        intensities (np.ndarray): Intensities of the peaks of all spectra.
+        offsets (np.ndarray): Start of the peaks of every spectrum, followed by the total number of peaks.
+
+    Returns:
+        list: The spectrum hash of every spectrum.
+    """
+    # truncated towards zero, as matchms does with int()
+    mz = (mz * 10**MZ_PRECISION).astype(np.int64)
+    intensities = (intensities * 10**INTENSITY_PRECISION).astype(np.int64)
+    segments = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    # by spectrum, increasing m/z and then decreasing intensity
+    order = np.lexsort((-intensities, mz, segments))
+    peaks = np.char.add(
+        np.char.add(mz[order].astype(str), ":"), intensities[order].astype(str)
+    ).tolist()
+    return [
+        hashlib.sha256(" ".join(peaks[start:end]).encode("utf-8")).hexdigest()[
+            :HASH_LENGTH
+        ]
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+def hash_spectra(
+    spectra: T.Sequence[Spectrum],
+    use_approximation: bool = False,
+) -> T.List[str]:
+    """
+    `Spectrum.consistent_hash` of many spectra, with their peaks hashed in bulk.
+
+    The hashes are memoized on the spectra, and the already memoized ones are reused.
+    """
+    missing = [
+        spectrum
+        for spectrum in spectra
+        if ("consistent", use_approximation) not in spectrum.__dict__.get("_hashes", {})
+    ]
+    if missing:
+        fragments = [spectrum._peaks for spectrum in missing]
+        offsets = np.cumsum([0, *(len(peaks) for peaks in fragments)])
+        spectrum_hashes = peak_hashes(
+            np.concatenate([peaks.mz for peaks in fragments]),
+            np.concatenate([peaks.intensities for peaks in fragments]),
+            offsets,
         )
+        for spectrum, spectrum_hash in zip(missing, spectrum_hashes):
+            spectrum._memoize(("spectrum", False), lambda: spectrum_hash)
+    return [spectrum.consistent_hash(use_approximation) for spectrum in spectra]
@@ -0,0 +1,228 @@
+import json
+import shutil
+import typing as T
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+
+from ms2mol_evaluation.spectrum import Spectrum
+
+PEAKS_FILE = "peaks.arrow"
+OFFSETS_FILE = "offsets.npy"
+METADATA_FILE = "metadata.arrow"
+
+
+def _to_json(value: T.Any) -> str:
+    return json.dumps(
+        value, default=lambda x: x.item() if hasattr(x, "item") else str(x)
+    )
+
+
+def _metadata_table(metadata: T.List[T.Dict[str, T.Any]]) -> pa.Table:
+    """
+    Build one column per metadata key, keys with mixed value types are stored as JSON.
+    """
+    keys = list(dict.fromkeys(key for entry in metadata for key in entry))
+    columns = {}
+    json_columns = []
+    for key in keys:
+        values = [entry.get(key) for entry in metadata]
+        try:
+            columns[key] = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            columns[key] = pa.array(
+                [None if value is None else _to_json(value) for value in values],
+                type=pa.string(),
+            )
+            json_columns.append(key)
+    table = pa.table(columns)
+    return table.replace_schema_metadata({"json_columns": json.dumps(json_columns)})
+
+
+def _read_arrow(path: Path) -> pa.Table:
+    with pa.memory_map(str(path), "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def _write_arrow(table: pa.Table, path: Path) -> None:
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(len(table), 1))
+
+
+class SpectrumStore(Sequence):
+    """
+    Columnar, memory-mapped collection of spectra.
+
+    The peaks of all spectra are two flat `mz`/`intensity` buffers in an Arrow
+    file, indexed by a row offset array, next to one column per metadata key.
+    Everything is memory-mapped on open, so loading is almost instant and the
+    pages are shared between the processes using the same store. `Spectrum`
+    objects are only built when an item is accessed.
+    """
+
+    def __init__(self, path: T.Union[str, Path]):
+        """
+        Args:
+            path (str | Path): Directory written by `SpectrumStore.write`.
+        """
+        self._path = Path(path)
+        peaks = _read_arrow(self._path / PEAKS_FILE)
+        self._mz = peaks.column("mz").combine_chunks().to_numpy()
+        self._intensities = peaks.column("intensity").combine_chunks().to_numpy()
+        self._offsets = np.load(self._path / OFFSETS_FILE, mmap_mode="r")
+        self._metadata = _read_arrow(self._path / METADATA_FILE)
+        self._json_columns = set(
+            json.loads(self._metadata.schema.metadata[b"json_columns"])
+        )
+
+    @staticmethod
+    def exists(path: T.Union[str, Path]) -> bool:
+        return (Path(path) / METADATA_FILE).exists()
+
+    @classmethod
+    def write(
+        cls,
+        spectra: T.Iterable[Spectrum],
+        path: T.Union[str, Path],
+    ) -> "SpectrumStore":
+        """
+        Write spectra to a new store and open it.
+
+        The store is written next to `path` and moved into place once complete,
+        so a reader never sees a partial store.
+
+        Args:
+            spectra (Iterable[Spectrum]): Spectra to store.
+            path (str | Path): Directory of the store.
+        """
+        path = Path(path)
+        mzs, intensities, metadata = [], [], []
+        for spectrum in spectra:
+            mzs.append(spectrum.mz)
+            intensities.append(spectrum.intensities)
+            metadata.append(spectrum.metadata)
+
+        offsets = np.zeros(len(mzs) + 1, dtype=np.int64)
+        np.cumsum([len(mz) for mz in mzs], out=offsets[1:])
+        peaks = pa.table(
+            {
+                "mz": np.concatenate(mzs) if mzs else np.array([], dtype=np.float64),
+                "intensity": np.concatenate(intensities)
+                if intensities
+                else np.array([], dtype=np.float64),
+            }
+        )
+
+        tmp_path = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir(parents=True)
+        _write_arrow(peaks, tmp_path / PEAKS_FILE)
+        np.save(tmp_path / OFFSETS_FILE, offsets)
+        _write_arrow(_metadata_table(metadata), tmp_path / METADATA_FILE)
+        shutil.rmtree(path, ignore_errors=True)
+        tmp_path.rename(path)
+        return cls(path)
+
+    def __getstate__(self) -> T.Dict[str, T.Any]:
+        # workers re-open the memory map instead of receiving a copy of the data
+        return {"path": self._path}
+
+    def __setstate__(self, state: T.Dict[str, T.Any]) -> None:
+        self.__init__(state["path"])
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Spectrum index {index} out of range.")
+        mz, intensities = self.peaks(index)
+        metadata = {
+            key: json.loads(value) if key in self._json_columns else value
+            for key, value in self._metadata.slice(index, 1).to_pylist()[0].items()
+            if value is not None
+        }
+        return Spectrum(
+            mz=mz,
+            intensities=intensities,
+            metadata=metadata,
+            metadata_harmonization=False,
+        )
+
+    def __repr__(self) -> str:
+        return f"SpectrumStore({str(self._path)!r}, {len(self)} spectra)"
+
+    def peaks(self, index: int) -> T.Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the m/z and intensity arrays of a spectrum as views into the store.
+        """
+        start, stop = self._offsets[index], self._offsets[index + 1]
+        return self._mz[start:stop], self._intensities[start:stop]
+
+    def take(self, indices: T.Iterable[int]) -> T.List[Spectrum]:
+        """
+        Materialize the spectra at the given positions.
+        """
+        return [self[int(index)] for index in indices]
+
+    def get(
+        self,
+        key: str,
+        default=None,
+        indices: T.Optional[T.Sequence[int]] = None,
+    ) -> T.List[T.Any]:
+        """
+        Returns the value of a metadata key for all spectra, without building them.
+
+        Args:
+            key (str): The metadata key.
+            default: Value of the spectra without this key.
+            indices (Sequence[int], optional): Only return the values of the spectra
+                at these positions, only these are converted to Python objects.
+        """
+        if key not in self._metadata.column_names:
+            return [default] * (len(self) if indices is None else len(indices))
+        column = self._metadata.column(key)
+        if indices is not None:
+            column = column.take(pa.array(np.asarray(indices, dtype=np.int64)))
+        values = column.to_pylist()
+        if key in self._json_columns:
+            values = [None if value is None else json.loads(value) for value in values]
+        return [default if value is None else value for value in values]
+
+    @property
+    def mz(self) -> np.ndarray:
+        """Flat m/z buffer of all spectra."""
+        return self._mz
+
+    @property
+    def intensities(self) -> np.ndarray:
+        """Flat intensity buffer of all spectra."""
+        return self._intensities
+
+    @property
+    def offsets(self) -> np.ndarray:
+        """Row offsets, spectrum i spans `offsets[i] : offsets[i + 1]` of the flat buffers."""
+        return self._offsets
+
+
+def get_metadata(
+    spectra: T.Union[SpectrumStore, T.List[Spectrum]],
+    key: str,
+) -> T.List[T.Any]:
+    """
+    Returns a metadata value for every spectrum.
+
+    Collections with their own column access (`SpectrumStore`, `IndexedMGF`) are
+    read directly, without building the spectra.
+    """
+    if hasattr(spectra, "get"):
+        return spectra.get(key)
+    return [spectrum.get(key) for spectrum in spectra]
@@ -0,0 +1,278 @@
+import collections
+import time
+import typing as T
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from dict_hash import sha256
+from joblib import Parallel, delayed, effective_n_jobs
+from tqdm import tqdm
+
+from ms2mol_evaluation.evaluation import (
+    RANKING_COLUMNS,
+    evaluation_summary,
+    rank_columns,
+    spectrum_metadata,
+    true_candidate_rank,
+)
+from ms2mol_evaluation.metfrag import (
+    cache_metfrag_batch,
+    read_results,
+    split_in_batches,
+)
+from ms2mol_evaluation.metfrag_worker import metfrag_mode
+from ms2mol_evaluation.scheduling import simulate_makespan
+from ms2mol_evaluation.spectrum import Spectrum, hash_spectra
+
+CHECKPOINT_DTYPES = {
+    "identifier": str,
+    "spectrum_hash": str,
+    "params_hash": str,
+    "n_candidates": np.int64,
+    "rank": np.int64,
+    "rank_min": np.int64,
+    "rank_max": np.int64,
+    "score": np.float64,
+    "failed": bool,
+}
+
+
+def rank_metfrag_batch(
+    positions: T.List[int],
+    spectra: T.List[Spectrum],
+    config_params: T.List[T.Optional[T.Dict[str, T.Any]]],
+) -> T.Tuple[T.List[T.Tuple[int, T.Tuple[int, int, int, int, float], bool]], str]:
+    """
+    Run MetFrag on a batch and rank the true molecule of each spectrum, in the worker.
+
+    Only the ranks travel back to the parent, never the candidate tables. If
+    MetFrag fails, the spectra are run again one at a time (the finished ones
+    are cached), and the spectra it fails on count as misses instead of
+    stopping the evaluation.
+
+    Returns:
+        tuple: The position of each spectrum with its
+            (n_candidates, rank, rank_min, rank_max, score) and whether MetFrag
+            failed, and how the worker ran MetFrag (see `metfrag_mode`).
+    """
+    try:
+        configs = [config for _, config in cache_metfrag_batch(spectra, config_params)]
+    except Exception:
+        configs = []
+        for spectrum, params in zip(spectra, config_params, strict=True):
+            try:
+                configs.extend(
+                    config for _, config in cache_metfrag_batch([spectrum], [params])
+                )
+            except Exception as error:
+                warnings.warn(
+                    f"MetFrag failed on {spectrum.get('identifier')}: {error}",
+                    RuntimeWarning,
+                )
+                configs.append(None)
+    ranked = []
+    for position, spectrum, config in zip(positions, spectra, configs):
+        result = (
+            pd.DataFrame(columns=list(RANKING_COLUMNS))
+            if config is None
+            else read_results(config, RANKING_COLUMNS)
+        )
+        ranked.append(
+            (
+                position,
+                (len(result), *true_candidate_rank(result, spectrum.get("inchikey"))),
+                config is None,
+            )
+        )
+    return ranked, metfrag_mode()
+
+
+class Checkpoint:
+    """
+    Append-only CSV of the ranks of the spectra evaluated so far.
+
+    Entries are keyed by the spectrum hash (as in the completion manifest) and
+    the hash of its MetFrag parameters, so a restart with other parameters does
+    not reuse them. The identifier is only kept for reading the file. Runs
+    MetFrag failed on are kept as misses with "failed" set, so a restart does
+    not run them again, delete their lines to retry them.
+    """
+
+    def __init__(self, path: T.Union[str, Path]):
+        self._path = Path(path)
+
+    def load(
+        self,
+    ) -> T.Dict[T.Tuple[str, str], T.Tuple[T.Tuple[int, int, int, int, float], bool]]:
+        """
+        Returns the ranks of every checkpointed (spectrum_hash, params_hash), and whether MetFrag failed.
+        """
+        if not self._path.exists():
+            return {}
+        df = pd.read_csv(self._path, dtype=str, keep_default_na=False)
+        for column in ("n_candidates", "rank", "rank_min", "rank_max", "score"):
+            df[column] = pd.to_numeric(df[column], errors="coerce")
+        df["failed"] = df["failed"].map({"True": True, "False": False})
+        # a crash while appending can leave an incomplete last line, which is
+        # the only one without a valid "failed", the last column
+        df = df[df["failed"].notna()].astype(CHECKPOINT_DTYPES)
+        return {
+            (spectrum_hash, params_hash): (tuple(row), failed)
+            for _, spectrum_hash, params_hash, *row, failed in df.itertuples(
+                index=False
+            )
+        }
+
+    def append(self, entries: T.List[T.Dict[str, T.Any]]) -> None:
+        header = not self._path.exists()
+        with open(self._path, "a+b") as f:
+            # start after the incomplete last line a crash can leave
+            if f.tell() > 0:
+                f.seek(-1, 2)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+        pd.DataFrame(entries, columns=list(CHECKPOINT_DTYPES)).to_csv(
+            self._path, mode="a", header=header, index=False
+        )
+
+
+def run_streaming_evaluation(
+    spectra: T.List[Spectrum],
+    config_params: T.List[T.Optional[T.Dict[str, T.Any]]],
+    checkpoint_path: T.Union[str, Path],
+    n_jobs: int = -1,
+    batch_size: int = 8,
+    report_every: float = 60.0,
+    summary_path: T.Optional[T.Union[str, Path]] = None,
+    seed: int = 42,
+    summarize: T.Callable[[pd.DataFrame], pd.DataFrame] = evaluation_summary,
+    costs: T.Optional[np.ndarray] = None,
+    costs_in_seconds: bool = False,
+) -> pd.DataFrame:
+    """
+    Run and rank MetFrag on all spectra, consuming the batches as they finish.
+
+    Spectra already in the checkpoint are not submitted again. The others are
+    submitted in a random order, so the spectra finished at any time are a
+    random sample and the running top-k accuracies, printed (and written to
+    `summary_path`) every `report_every` seconds, estimate the final ones.
+    Entries of the same spectrum (e.g. with several configs) are kept next to
+    each other, so they share a batch. Every finished batch is appended to the
+    checkpoint, so a crash only loses the batches still running.
+
+    With `costs`, the most expensive spectra are submitted first instead, so
+    the long runs do not end up in the tail while most workers are idle, and
+    the actual makespan is reported, next to the predicted one if the costs
+    are in seconds. The running estimates are then biased towards the
+    expensive spectra.
+
+    Args:
+        spectra (List[Spectrum]): The spectra to evaluate.
+        config_params (List[dict]): MetFrag parameters of each spectrum.
+        checkpoint_path (str | Path): CSV checkpoint of the finished spectra.
+        n_jobs (int): Number of joblib workers.
+        batch_size (int): Number of spectra per MetFrag process.
+        report_every (float): Seconds between running estimates.
+        summary_path (str | Path, optional): Where to write the running estimate.
+        seed (int): Seed of the submission order.
+        summarize (Callable): Computes the running estimate from the rank table of
+            the finished spectra, whose index is their position in `spectra`.
+        costs (np.ndarray, optional): Predicted runtime of each spectrum, see `predict_costs`.
+        costs_in_seconds (bool): Whether the costs are runtimes from a fitted
+            `CostModel`, otherwise they are unitless and only order the spectra.
+
+    Returns:
+        pd.DataFrame: The rank table of all spectra, as `rank_table`, and whether
+            MetFrag "failed" on them.
+    """
+    metadata = spectrum_metadata(spectra)
+    if costs is not None:
+        costs = np.asarray(costs, dtype=np.float64)
+    spectrum_hashes = hash_spectra(spectra)
+    params_hashes = [sha256({"params": params}) for params in config_params]
+    keys = list(zip(spectrum_hashes, params_hashes, strict=True))
+
+    identifiers = metadata["identifier"].tolist()
+    checkpoint = Checkpoint(checkpoint_path)
+    done = checkpoint.load()
+    rows = [done[key][0] if key in done else None for key in keys]
+    failed = np.array([key in done and done[key][1] for key in keys], dtype=bool)
+    pending = np.array([i for i, row in enumerate(rows) if row is None], dtype=int)
+    groups, _ = pd.factorize(np.asarray(spectrum_hashes, dtype=object))
+    n_groups = groups.max(initial=-1) + 1
+    if costs is None:
+        group_order = np.random.default_rng(seed).permutation(n_groups)
+    else:
+        # longest processing time first
+        group_costs = np.bincount(groups, weights=costs, minlength=n_groups)
+        group_order = np.argsort(np.argsort(-group_costs, kind="stable"))
+    pending = pending[np.argsort(group_order[groups[pending]], kind="stable")]
+    print(f"{len(rows) - len(pending)} spectra restored from {checkpoint_path}")
+
+    def report() -> None:
+        finished = [i for i, row in enumerate(rows) if row is not None]
+        if not finished:
+            return
+        summary = summarize(
+            metadata.iloc[finished].assign(**rank_columns([rows[i] for i in finished]))
+        )
+        tqdm.write(f"Running estimate on {len(finished)}/{len(rows)} spectra:")
+        tqdm.write(summary.to_string(float_format="{:.4f}".format))
+        if summary_path is not None:
+            summary.to_csv(summary_path)
+
+    batches = split_in_batches(pending.tolist(), batch_size)
+    completions = Parallel(n_jobs=n_jobs, return_as="generator_unordered")(
+        delayed(rank_metfrag_batch)(
+            positions,
+            [spectra[i] for i in positions],
+            [config_params[i] for i in positions],
+        )
+        for positions in batches
+    )
+    start = last_report = time.monotonic()
+    modes = collections.Counter()
+    for ranked, mode in tqdm(completions, total=len(batches), desc="Running MetFrag"):
+        modes[mode] += 1
+        entries = []
+        for position, row, run_failed in ranked:
+            rows[position] = row
+            failed[position] = run_failed
+            entries.append(
+                dict(
+                    zip(
+                        CHECKPOINT_DTYPES,
+                        (identifiers[position], *keys[position], *row, run_failed),
+                    )
+                )
+            )
+        checkpoint.append(entries)
+        if time.monotonic() - last_report >= report_every:
+            report()
+            last_report = time.monotonic()
+    report()
+    if modes["java -jar"]:
+        print(
+            f"{modes['java -jar']}/{len(batches)} batches ran one JVM per spectrum "
+            "instead of a persistent MetFrag worker, --batch_size saves no JVM startups there"
+        )
+    if costs is not None and batches:
+        actual = time.monotonic() - start
+        if costs_in_seconds:
+            predicted = simulate_makespan(
+                [costs[positions].sum() for positions in batches],
+                effective_n_jobs(n_jobs),
+            )
+            print(f"Makespan: predicted {predicted:.1f}, actual {actual:.1f} s")
+        else:
+            print(f"Makespan: {actual:.1f} s (no fitted cost model to predict it)")
+
+    if failed.any():
+        print(
+            f"MetFrag failed on {failed.sum()} spectra, counted as misses "
+            f"(see the manifest and {checkpoint_path})"
+        )
+
+    return metadata.assign(**rank_columns(rows), failed=failed)
@@ -0,0 +1,160 @@
+import itertools
+import typing as T
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ms2mol_evaluation.evaluation import TOP_K, compare_configs
+from ms2mol_evaluation.metfrag_config import MetFragConfig
+from ms2mol_evaluation.spectrum import Spectrum
+from ms2mol_evaluation.streaming import run_streaming_evaluation
+
+# MetFrag's DatabaseSearchRelativeMassDeviation in `MetFragConfig`
+DEFAULT_PPM = 10.0
+
+
+def expand_grid(
+    grid: T.Union[T.Dict[str, T.List[T.Any]], T.List[T.Dict[str, T.Any]]],
+) -> T.List[T.Dict[str, T.Any]]:
+    """
+    Returns the MetFrag parameters of every configuration of a sweep.
+
+    Args:
+        grid (dict | list): Values of every parameter, combined as a cartesian
+            product, or an explicit list of parameter dicts.
+    """
+    if isinstance(grid, list):
+        return [dict(params) for params in grid]
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+
+
+def config_name(params: T.Dict[str, T.Any]) -> str:
+    if not params:
+        return "default"
+    return ",".join(f"{key}={value}" for key, value in params.items())
+
+
+def dedupe_configs(
+    configs: T.List[T.Dict[str, T.Any]],
+) -> T.Dict[str, T.Dict[str, T.Any]]:
+    """
+    Drop the configurations MetFrag would run identically, keeping the first one.
+
+    Configurations are compared by the hash of their complete MetFrag config,
+    so e.g. setting a parameter to its default is the same as not setting it.
+
+    Returns:
+        dict: The parameters of every distinct configuration, by name.
+    """
+    distinct = {}
+    seen = set()
+    for params in configs:
+        config_hash = MetFragConfig(
+            100.0,
+            "[M+H]+",
+            peak_list_file="peak_list.txt",
+            results_path=".",
+            results_file="results",
+            config_params=params,
+        ).consistent_hash()
+        if config_hash not in seen:
+            seen.add(config_hash)
+            distinct[config_name(params)] = params
+    return distinct
+
+
+def widest_ppm(configs: T.Dict[str, T.Dict[str, T.Any]]) -> float:
+    """
+    Returns the widest candidate mass window of a sweep, candidates retrieved with it serve every configuration.
+    """
+    return max(
+        float(params.get("DatabaseSearchRelativeMassDeviation", DEFAULT_PPM))
+        for params in configs.values()
+    )
+
+
+def sweep_summary(
+    ranks: pd.DataFrame,
+    ks: T.Sequence[int] = TOP_K,
+    by: T.Optional[T.Union[str, T.List[str]]] = None,
+    tie_policy: str = "ordinal",
+) -> pd.DataFrame:
+    """
+    Top-k accuracy of every configuration of a sweep, side by side.
+
+    Args:
+        ranks (pd.DataFrame): Table from `run_sweep`.
+        ks (Sequence[int]): Values of k.
+        by (str | List[str], optional): Strata to group by within each configuration.
+        tie_policy (str): See `top_k_hits`.
+    """
+    return compare_configs(
+        {
+            name: group.drop(columns="config")
+            for name, group in ranks.groupby("config", sort=False)
+        },
+        ks,
+        by,
+        tie_policy,
+    )
+
+
+def run_sweep(
+    spectra: T.List[Spectrum],
+    configs: T.Dict[str, T.Dict[str, T.Any]],
+    base_params: T.List[T.Optional[T.Dict[str, T.Any]]],
+    checkpoint_path: T.Union[str, Path],
+    n_jobs: int = -1,
+    batch_size: T.Optional[int] = None,
+    report_every: float = 60.0,
+    summary_path: T.Optional[T.Union[str, Path]] = None,
+) -> pd.DataFrame:
+    """
+    Run and rank MetFrag on every spectrum with every configuration of a sweep.
+
+    All (spectrum, configuration) runs go through the same worker pool. The
+    runs of a spectrum are submitted together, so they share its hash, its
+    peak list and its candidates (from `base_params`), and only differ in the
+    swept parameters.
+
+    Args:
+        spectra (List[Spectrum]): The spectra to evaluate.
+        configs (Dict[str, dict]): Swept parameters of every configuration, by name,
+            see `dedupe_configs`.
+        base_params (List[dict]): Parameters of each spectrum shared by all
+            configurations, e.g. its candidate file.
+        checkpoint_path (str | Path): CSV checkpoint of the finished runs.
+        n_jobs (int): Number of joblib workers.
+        batch_size (int, optional): Number of runs per MetFrag process, defaults
+            to the number of configurations.
+        report_every (float): Seconds between running estimates.
+        summary_path (str | Path, optional): Where to write the running estimate.
+
+    Returns:
+        pd.DataFrame: The rank table of every run, with its configuration in "config".
+    """
+    names = np.array(list(configs), dtype=object)
+    job_spectra = [spectrum for spectrum in spectra for _ in names]
+    job_params = [
+        {**(base or {}), **params}
+        for base in base_params
+        for params in configs.values()
+    ]
+    job_names = np.tile(names, len(spectra))
+
+    ranks = run_streaming_evaluation(
+        job_spectra,
+        job_params,
+        checkpoint_path=checkpoint_path,
+        n_jobs=n_jobs,
+        batch_size=batch_size or len(configs),
+        report_every=report_every,
+        summary_path=summary_path,
+        summarize=lambda finished: sweep_summary(
+            finished.assign(config=job_names[finished.index])
+        ),
+    )
+    ranks.insert(0, "config", job_names)
+    return ranks
@@ -0,0 +1,164 @@
+import argparse
+import subprocess
+import sys
+import tempfile
+import typing as T
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from downloaders import BaseDownloader
+from tqdm import tqdm
+
+from ms2mol_evaluation.isdb import download_isdb, filter_massspecgym_spectra, load_isdb
+from ms2mol_evaluation.lotus import load_lotus_for_metfrag, write_local_database
+from ms2mol_evaluation.massspecgym import load_massspecgym, to_spectra
+from ms2mol_evaluation.metfrag import (
+    cached_metfrag_config,
+    get_results_csv,
+    write_metfrag_config,
+    write_peak_list,
+)
+from ms2mol_evaluation.metfrag_config import local_database_path
+from ms2mol_evaluation.metfrag_worker import METFRAG_JAR, MetFragWorker
+from ms2mol_evaluation.spectrum import Spectrum
+
+RANKED_COLUMNS = ["InChIKey1", "Score"]
+
+
+def write_runs(
+    spectra: T.List[Spectrum],
+    config_params: T.Optional[T.Dict[str, T.Any]],
+    directory: Path,
+) -> T.List[T.Tuple[str, Path]]:
+    """
+    Write the parameter file and peak list of every spectrum, with its results in `directory`.
+
+    Returns:
+        list: The parameter file and results CSV of every spectrum.
+    """
+    directory.mkdir(parents=True)
+    runs = []
+    for spectrum in spectra:
+        spectrum_hash, config_hash, config = cached_metfrag_config(
+            spectrum, config_params
+        )
+        config.relocate(
+            directory / f"{spectrum_hash}.txt",
+            directory / f"{spectrum_hash}_{config_hash}",
+        )
+        Path(config.get_results_path()).mkdir()
+        write_peak_list(spectrum, config.get_peak_list_file())
+        runs.append((write_metfrag_config(config, directory), get_results_csv(config)))
+    return runs
+
+
+def read_ranked(results_csv: Path) -> pd.DataFrame:
+    try:
+        return pd.read_csv(results_csv, usecols=RANKED_COLUMNS)
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return pd.DataFrame(columns=RANKED_COLUMNS)
+
+
+def same_ranking(expected: pd.DataFrame, actual: pd.DataFrame) -> bool:
+    """
+    Whether two MetFrag outputs rank the same candidates in the same order with the same scores.
+    """
+    return expected["InChIKey1"].tolist() == actual["InChIKey1"].tolist() and bool(
+        np.allclose(
+            expected["Score"].to_numpy(dtype=np.float64),
+            actual["Score"].to_numpy(dtype=np.float64),
+            equal_nan=True,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that the persistent MetFrag worker ranks spectra exactly like one fresh JVM per spectrum, in any order."
+    )
+    parser.add_argument(
+        "--n_spectra",
+        type=int,
+        default=10,
+        help="Number of random spectra to run (default: 10)",
+    )
+    parser.add_argument(
+        "--database_type",
+        choices=["Postgres", "LocalCSV", "LocalPSV"],
+        default="Postgres",
+        help="Candidate database used by MetFrag (default: Postgres)",
+    )
+    parser.add_argument("--seed", type=int, default=42, help="Seed (default: 42)")
+    args = parser.parse_args()
+    _ = BaseDownloader(auto_extract=False).download(
+        "https://github.com/ipb-halle/MetFragRelaunched/releases/download/v2.6.6/MetFragCommandLine-2.6.6.jar",
+        METFRAG_JAR,
+    )
+
+    massspecgym = load_massspecgym()
+    download_isdb()
+    spectra = filter_massspecgym_spectra(
+        to_spectra(massspecgym), load_isdb(), hydrogen_adduct_only=False
+    )
+    rng = np.random.default_rng(args.seed)
+    spectra = [
+        spectra[i]
+        for i in rng.choice(len(spectra), min(args.n_spectra, len(spectra)), False)
+    ]
+
+    config_params = None
+    if args.database_type != "Postgres":
+        config_params = {"MetFragDatabaseType": args.database_type}
+        if not local_database_path("lotus", args.database_type).exists():
+            write_local_database(load_lotus_for_metfrag(), "lotus", args.database_type)
+
+    with tempfile.TemporaryDirectory(prefix="metfrag-verify-") as tmp:
+        fresh = write_runs(spectra, config_params, Path(tmp) / "fresh")
+        for config_file, _ in tqdm(fresh, desc="One JVM per spectrum"):
+            subprocess.run(
+                ["java", "-jar", METFRAG_JAR, config_file],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+
+        # the same spectra in both orders, so state leaking from one job into
+        # the next one shows up as a difference
+        resident = {}
+        for name, order in (("forward", 1), ("reversed", -1)):
+            runs = write_runs(spectra, config_params, Path(tmp) / name)
+            worker = MetFragWorker()
+            for config_file, _ in tqdm(runs[::order], desc=f"Worker, {name}"):
+                worker.run(config_file)
+            worker.close()
+            resident[name] = (runs, worker.restarts)
+
+        failures = 0
+        for name, (runs, restarts) in resident.items():
+            if restarts:
+                failures += 1
+                print(
+                    f"Worker ({name}): the JVM was restarted {restarts} times "
+                    f"for {len(runs)} spectra, it does not stay up across jobs"
+                )
+            for spectrum, (_, expected), (_, actual) in zip(spectra, fresh, runs):
+                expected, actual = read_ranked(expected), read_ranked(actual)
+                same = same_ranking(expected, actual)
+                if not same:
+                    failures += 1
+                    print(
+                        f"Worker ({name}): {spectrum.get('identifier')} ranked "
+                        f"{len(actual)} candidates, {len(expected)} with a fresh JVM, "
+                        "not in the same order or with other scores"
+                    )
+
+    if failures:
+        print("The persistent worker is not safe, run with METFRAG_PERSISTENT_WORKER=0")
+        sys.exit(1)
+    print(
+        f"The persistent worker matched a fresh JVM on {len(spectra)} spectra in both orders"
+    )
+
+
+if __name__ == "__main__":
+    main()